@@ -9,19 +9,54 @@
 # this distribution.
 # --
 
-import json
-import urllib.parse as urlparse
-from importlib.metadata import distribution
+import threading
 
+# (distribution name, distribution path) -> editable project location
+_editable_locations = {}
+_lock = threading.Lock()
+
+
+def read_editable_project_location(name):
+    import json
+    import urllib.parse as urlparse
+    from importlib.metadata import distribution
 
-def Distribution(dist):
     location = None
-    content = distribution(dist.metadata['name']).read_text('direct_url.json')
+    content = distribution(name).read_text('direct_url.json')
     if content is not None:
         direct_url_info = json.loads(content)
         if direct_url_info.get('dir_info', {}).get('editable', False):
             location = urlparse.urlsplit(direct_url_info['url'])[2]
 
-    dist.editable_project_location = location
+    return location
+
+
+def get_editable_project_location(name, path):
+    """Memoised editable project location of a distribution."""
+    key = (name, path)
+
+    if key not in _editable_locations:
+        location = read_editable_project_location(name)
+        with _lock:
+            _editable_locations[key] = location
+
+    return _editable_locations[key]
+
+
+def clear_cache():
+    with _lock:
+        _editable_locations.clear()
+
+
+def Distribution(dist):
+    if 'editable_project_location' not in vars(dist):
+        dist.editable_project_location = get_editable_project_location(
+            dist.metadata['name'], str(dist.locate_file(''))
+        )
 
     return dist
+
+
+def get_location(dist):
+    """Editable project location or installation location of a distribution."""
+    return Distribution(dist).editable_project_location or str(dist.locate_file(''))
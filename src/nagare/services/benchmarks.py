@@ -0,0 +1,254 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Micro-benchmarks of the injection and registry hot paths.
+
+Usage:
+  python -m nagare.services.benchmarks [-o results.json] [-b baseline.json]
+"""
+
+import sys
+import json
+import timeit
+import argparse
+import platform
+import functools
+
+from .proxy import proxy_to
+from .plugins import Plugins
+from .services import Services
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function receives the services registry and returns the
+    function to time.
+    """
+
+    def _(f):
+        BENCHMARKS[name] = f
+        return f
+
+    return _
+
+
+def create_services(nb_services=200):
+    services = Services()
+    services.update({'service{}'.format(i): object() for i in range(nb_services)})
+    services['c'] = 42
+    services['nested'] = Services()
+    services['nested']['session'] = 10
+
+    return services
+
+
+def positional(a, c_service):
+    return a
+
+
+def keyword_only(a, *, c_service):
+    return a
+
+
+def optional(a, c_service, d_service=None):
+    return a
+
+
+class Class(object):
+    def __init__(self, a, c_service):
+        self.a = a
+
+
+SHAPES = {'positional': positional, 'keyword_only': keyword_only, 'optional': optional, 'class': Class}
+
+for shape, f in SHAPES.items():
+
+    @benchmark('direct.' + shape)
+    def _(services, f=f):
+        return lambda: f(1, c_service=42)
+
+    @benchmark('call.' + shape)
+    def _(services, f=f):
+        return lambda: services(f, 1)
+
+    @benchmark('inject.' + shape)
+    def _(services, f=f):
+        return functools.partial(services.inject(f), 1)
+
+    @benchmark('inject_compiled.' + shape)
+    def _(services, f=f):
+        return functools.partial(services.inject(f, compile=True), 1)
+
+
+@benchmark('get_dependency.found')
+def _(services):
+    return lambda: services.get_dependency('c_service')
+
+
+@benchmark('get_dependency.missing')
+def _(services):
+    return lambda: services.get_dependency('d_service', False)
+
+
+@benchmark('get_service.top')
+def _(services):
+    return lambda: services.get_service(('c',))
+
+
+@benchmark('get_service.nested')
+def _(services):
+    return lambda: services.get_service(('nested', 'session'))
+
+
+@benchmark('get_service.dotted')
+def _(services):
+    return lambda: services.get_service('nested.session')
+
+
+@benchmark('frozen.getitem')
+def _(services):
+    services = services.freeze()
+    return lambda: services['c']
+
+
+@benchmark('frozen.get_dependency')
+def _(services):
+    services = services.freeze()
+    return lambda: services.get_dependency('c_service')
+
+
+@benchmark('plugins.getitem')
+def _(services):
+    plugins = Plugins()
+    plugins.update(services.items())
+
+    return lambda: plugins['c']
+
+
+class Target(object):
+    def method(self, a):
+        return a
+
+
+@proxy_to(Target)
+class WrappingProxy(object):
+    def __init__(self, target):
+        self.proxy_target = target
+
+
+@proxy_to(Target, fast=True)
+class BindingProxy(object):
+    def __init__(self, target):
+        self.proxy_target = target
+
+
+@benchmark('proxy.direct')
+def _(services):
+    target = Target()
+    return lambda: target.method(1)
+
+
+@benchmark('proxy.wrapped')
+def _(services):
+    proxy = WrappingProxy(Target())
+    return lambda: proxy.method(1)
+
+
+@benchmark('proxy.fast')
+def _(services):
+    proxy = BindingProxy(Target())
+    return lambda: proxy.method(1)
+
+
+def run(names=None, number=100000, repeat=5, nb_services=200):
+    """Time the benchmarks.
+
+    Args:
+      names: prefixes of the benchmarks to run (all by default)
+      number: number of calls in a measure
+      repeat: number of measures
+      nb_services: number of services in the registry
+
+    Return:
+      dictionary of the benchmark names -> best and mean time of a call, in nanoseconds
+    """
+    results = {}
+
+    for name, create in sorted(BENCHMARKS.items()):
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+
+        timings = timeit.repeat(create(create_services(nb_services)), number=number, repeat=repeat)
+        timings = [timing * 1e9 / number for timing in timings]
+        results[name] = {'best': min(timings), 'mean': sum(timings) / len(timings)}
+
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """Compare results against a baseline.
+
+    Args:
+      results: new benchmark results
+      baseline: benchmark results of reference
+      threshold: maximum allowed relative slowdown of the best time
+
+    Return:
+      list of ``(name, baseline time, new time)`` of the regressions
+    """
+    regressions = []
+
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if (reference is not None) and (result['best'] > reference['best'] * (1 + threshold)):
+            regressions.append((name, reference['best'], result['best']))
+
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the services injection and registry')
+    parser.add_argument('names', nargs='*', help='prefixes of the benchmarks to run')
+    parser.add_argument('-n', '--number', type=int, default=100000, help='number of calls in a measure')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of measures')
+    parser.add_argument('-s', '--services', type=int, default=200, help='number of services in the registry')
+    parser.add_argument('-o', '--output', help='JSON file to write the results to')
+    parser.add_argument('-b', '--baseline', help='JSON file of results to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2, help='allowed slowdown (default: 0.2)')
+    args = parser.parse_args(args)
+
+    results = run(args.names, args.number, args.repeat, args.services)
+    for name, result in sorted(results.items()):
+        print('{:40} {:10.1f} ns {:10.1f} ns'.format(name, result['best'], result['mean']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+        regressions = compare(results, baseline, args.threshold)
+        for name, reference, result in regressions:
+            print('Regression: {} {:.1f} ns -> {:.1f} ns'.format(name, reference, result))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Discovery of the entry points.
+
+The installed distributions are scanned once per process and their entry
+points indexed by groups and names. ``invalidate()`` forces a new scan.
+
+The index of the entry point groups can be cached on disk, in the file given
+by the ``NAGARE_ENTRY_POINTS_CACHE`` environment variable. The cache is
+rebuilt when the ``sys.path`` directories or their ``.dist-info`` /
+``.egg-info`` directories change.
+"""
+
+import os
+import sys
+import json
+import pathlib
+import hashlib
+import tempfile
+import importlib
+import threading
+from importlib import metadata
+from collections import OrderedDict
+
+from nagare import packaging
+
+CACHE_VERSION = 1
+CACHE_FILE = os.environ.get('NAGARE_ENTRY_POINTS_CACHE')
+
+
+def fingerprint(paths=None):
+    """Cheap signature of the installed distributions.
+
+    Args:
+      paths: directories to scan (``sys.path`` by default)
+
+    Return:
+      hexadecimal digest of the paths and mtimes of the metadata directories
+    """
+    signature = hashlib.sha256()
+
+    for path in sys.path if paths is None else paths:
+        signature.update(path.encode('utf-8', 'surrogateescape') + b'\0')
+
+        try:
+            signature.update(str(os.stat(path or '.').st_mtime_ns).encode('ascii'))
+
+            with os.scandir(path or '.') as entries:
+                infos = sorted(
+                    (entry.name, entry.stat().st_mtime_ns)
+                    for entry in entries
+                    if entry.name.endswith(('.dist-info', '.egg-info'))
+                )
+        except OSError:  # Not existing path or not a directory (i.e zip file)
+            continue
+
+        for name, mtime in infos:
+            signature.update('{}\0{}\0'.format(name, mtime).encode('utf-8', 'surrogateescape'))
+
+    return signature.hexdigest()
+
+
+def scan_entry_points():
+    """Read the entry points of all the installed distributions.
+
+    Return:
+      dictionary of the entry point groups -> list of ``(dist, name, entry)``
+    """
+    groups = {}
+
+    for dist in {dist.metadata['name']: dist for dist in metadata.distributions()}.values():
+        for entry in dist.entry_points:
+            groups.setdefault(entry.group, []).append((dist, entry.name, entry))
+
+    return groups
+
+
+def read_cache(cache_file, signature):
+    """Read the entry point groups from the cache.
+
+    Args:
+      cache_file: path to the cache
+      signature: fingerprint of the installed distributions
+
+    Return:
+      dictionary of the entry point groups -> distributions, or ``None`` if no valid cache
+    """
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (cache.get('version') != CACHE_VERSION) or (cache.get('fingerprint') != signature):
+        return None
+
+    distributions = {}
+    return {
+        group: [
+            distributions.setdefault(path, metadata.PathDistribution(pathlib.Path(path))) for path in paths
+        ]
+        for group, paths in cache['groups'].items()
+    }
+
+
+def write_cache(cache_file, signature, groups):
+    """Atomically write the entry point groups into the cache.
+
+    Args:
+      cache_file: path to the cache
+      signature: fingerprint of the installed distributions
+      groups: dictionary of the entry point groups -> list of ``(dist, name, entry)``
+    """
+    try:
+        paths = {
+            group: list(OrderedDict.fromkeys(str(dist._path) for dist, _, _ in entries))
+            for group, entries in groups.items()
+        }
+    except AttributeError:  # Distributions not found on the filesystem can't be cached
+        return
+
+    cache = {'version': CACHE_VERSION, 'fingerprint': signature, 'groups': paths}
+
+    try:
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)), prefix='.entry_points')
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+
+        os.replace(temp_file, cache_file)
+    except OSError:
+        os.remove(temp_file)
+
+
+class EntryPointsIndex(object):
+    """Entry points indexed by groups and names."""
+
+    def __init__(self, entry_points=None, distributions=None):
+        """Initialization.
+
+        Args:
+          entry_points: dictionary of the entry point groups -> list of ``(dist, name, entry)``
+          distributions: dictionary of the entry point groups -> distributions declaring entry points in the group,
+            for the groups whose entry points are not read yet
+        """
+        self.entry_points = dict(entry_points or {})
+        self.distributions = distributions or {}
+        self.names = {}
+        self.lock = threading.Lock()
+
+    def get_entry_points(self, group):
+        """Entry points of a group.
+
+        Return:
+          list of ``(dist, name, entry)``
+        """
+        entries = self.entry_points.get(group)
+        if entries is None:
+            with self.lock:
+                entries = self.entry_points.get(group)
+                if entries is None:
+                    entries = [
+                        (dist, entry.name, entry)
+                        for dist in self.distributions.get(group, ())
+                        for entry in dist.entry_points
+                        if entry.group == group
+                    ]
+                    self.entry_points[group] = entries
+
+        return entries
+
+    def get_entry_points_by_name(self, group):
+        """Entry points of a group, by names.
+
+        Return:
+          dictionary of the entry point names -> ``(dist, entry)``
+        """
+        names = self.names.get(group)
+        if names is None:
+            names = self.names[group] = {name: (dist, entry) for dist, name, entry in self.get_entry_points(group)}
+
+        return names
+
+
+def load_index(cache_file=None):
+    """Index the entry points of the installed distributions, using the cache if configured.
+
+    Args:
+      cache_file: path to the cache (``CACHE_FILE`` by default)
+
+    Return:
+      the entry points index
+    """
+    cache_file = cache_file or CACHE_FILE
+    if not cache_file:
+        return EntryPointsIndex(scan_entry_points())
+
+    signature = fingerprint()
+
+    distributions = read_cache(cache_file, signature)
+    if distributions is not None:
+        return EntryPointsIndex(distributions=distributions)
+
+    entry_points = scan_entry_points()
+    write_cache(cache_file, signature, entry_points)
+
+    return EntryPointsIndex(entry_points)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the entry points index of the process."""
+    global _index
+
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+
+            index = _index
+
+    return index
+
+
+def invalidate():
+    """Forget the entry points index of the process, i.e. after packages are installed."""
+    global _index
+
+    with _index_lock:
+        importlib.invalidate_caches()
+        packaging.clear_cache()
+        _index = None
+
+
+def get_entry_points(group):
+    """Entry points of a group.
+
+    Return:
+      list of ``(dist, name, entry)``
+    """
+    return get_index().get_entry_points(group)
+
+
+def get_entry_points_by_name(group):
+    """Entry points of a group, by names.
+
+    Return:
+      dictionary of the entry point names -> ``(dist, entry)``
+    """
+    return get_index().get_entry_points_by_name(group)
@@ -16,3 +16,7 @@ class BadConfiguration(Exception):
 
 class MissingService(Exception):
     """Missing service to inject."""
+
+
+class FrozenRegistry(Exception):
+    """Modification of a frozen registry."""
@@ -0,0 +1,263 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Dependencies graph of the services."""
+
+import sys
+from collections import OrderedDict
+
+from .exceptions import BadConfiguration
+
+
+class DependencyGraph(object):
+    """Directed graph of the services, from each service to the services it depends on."""
+
+    def __init__(self, nodes=()):
+        """Initialization.
+
+        Args:
+          nodes: iterable of ``(name, {dependency name: is_mandatory})``
+        """
+        self.nodes = OrderedDict()
+        for name, dependencies in nodes:
+            self.add(name, dependencies)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __contains__(self, name):
+        return name in self.nodes
+
+    def add(self, name, dependencies=None):
+        self.nodes[name] = OrderedDict(dependencies or {})
+
+    def dependencies(self, name):
+        """Services directly needed by a service.
+
+        Return:
+          dictionary of the dependency names -> is the dependency mandatory
+        """
+        return {dependency: is_mandatory for dependency, is_mandatory in self.nodes[name].items() if dependency in self}
+
+    def dependents(self, name):
+        """Services directly needing a service."""
+        return [node for node, dependencies in self.nodes.items() if name in dependencies]
+
+    def all_dependents(self, names):
+        """Services directly or transitively needing some services.
+
+        Args:
+          names: names of the services
+
+        Return:
+          set of the dependent service names, ``names`` not included
+        """
+        dependents = set()
+        to_visit = list(names)
+        while to_visit:
+            for dependent in self.dependents(to_visit.pop()):
+                if dependent not in dependents:
+                    dependents.add(dependent)
+                    to_visit.append(dependent)
+
+        return dependents - set(names)
+
+    def find_cycle(self):
+        """Search for circular dependencies.
+
+        Return:
+          list of the names of the services forming a cycle, or ``None``
+        """
+        visited = set()
+
+        for start in self.nodes:
+            if start in visited:
+                continue
+
+            path = [start]
+            on_path = {start}
+            stack = [iter(self.dependencies(start))]
+            visited.add(start)
+
+            while stack:
+                for dependency in stack[-1]:
+                    if dependency in on_path:
+                        return path[path.index(dependency) :] + [dependency]
+
+                    if dependency not in visited:
+                        visited.add(dependency)
+                        path.append(dependency)
+                        on_path.add(dependency)
+                        stack.append(iter(self.dependencies(dependency)))
+                        break
+                else:
+                    stack.pop()
+                    on_path.discard(path.pop())
+
+        return None
+
+    def check_order(self, order):
+        """Search for the services loaded before the services they depend on.
+
+        Args:
+          order: the service names, in loading order
+
+        Return:
+          list of ``(name, dependency name, is_mandatory)``
+        """
+        positions = {name: i for i, name in enumerate(order)}
+
+        return [
+            (name, dependency, is_mandatory)
+            for name in order
+            if name in self
+            for dependency, is_mandatory in self.dependencies(name).items()
+            if positions.get(dependency, -1) > positions[name]
+        ]
+
+    def topological_order(self, reverse=False):
+        """Order the services so that each one comes after its dependencies.
+
+        Args:
+          reverse: each service comes before its dependencies
+
+        Return:
+          list of the service names
+        """
+        order = []
+        remaining = OrderedDict((name, set(self.dependencies(name))) for name in self.nodes)
+
+        while remaining:
+            ready = [name for name, dependencies in remaining.items() if not dependencies]
+            if not ready:
+                raise BadConfiguration('circular dependencies: ' + ' -> '.join(self.find_cycle()))
+
+            for name in ready:
+                del remaining[name]
+                order.append(name)
+
+            for dependencies in remaining.values():
+                dependencies.difference_update(ready)
+
+        return order[::-1] if reverse else order
+
+    def critical_path(self, durations):
+        """Longest chain of dependencies, weighted by the durations of the services.
+
+        With all the independent services created concurrently, it's the lower
+        bound of the loading time.
+
+        Args:
+          durations: dictionary of the service names -> durations (``0`` if not found)
+
+        Return:
+          ``(total duration, list of the service names)``, the dependencies first
+        """
+        chains = {}  # Service name -> (duration of the longest chain ending with it, previous service in the chain)
+        for name in self.topological_order():
+            dependencies = [(chains[dependency][0], dependency) for dependency in self.dependencies(name)]
+            duration, previous = max(dependencies, default=(0, None))
+            chains[name] = (duration + durations.get(name, 0), previous)
+
+        if not chains:
+            return 0, []
+
+        name = max(chains, key=lambda name: chains[name][0])
+        duration = chains[name][0]
+
+        path = []
+        while name is not None:
+            path.append(name)
+            name = chains[name][1]
+
+        return duration, path[::-1]
+
+    def to_dict(self, durations=None):
+        """Serializable form of the graph.
+
+        Args:
+          durations: dictionary of the service names -> durations, in seconds
+
+        Return:
+          dictionary with the services, the dependencies and the critical path
+        """
+        durations = durations or {}
+        duration, path = self.critical_path(durations)
+
+        return {
+            'services': [
+                {'name': name, 'duration': durations.get(name), 'critical': name in path} for name in self.nodes
+            ],
+            'dependencies': [
+                {'service': name, 'dependency': dependency, 'mandatory': is_mandatory}
+                for name in self.nodes
+                for dependency, is_mandatory in self.dependencies(name).items()
+            ],
+            'critical_path': {'duration': duration, 'services': path},
+        }
+
+    def to_dot(self, durations=None):
+        """Graphviz form of the graph.
+
+        The services on the critical path are in red and the optional
+        dependencies are dashed.
+
+        Args:
+          durations: dictionary of the service names -> durations, in seconds
+
+        Return:
+          the DOT source
+        """
+        durations = durations or {}
+        path = self.critical_path(durations)[1]
+        critical_edges = set(zip(path[1:], path))
+
+        lines = ['digraph services {', '  rankdir=LR;', '  node [shape=box];']
+
+        for name in self.nodes:
+            label = name if name not in durations else '{}\\n{:.2f} ms'.format(name, durations[name] * 1000)
+            attributes = ['label="{}"'.format(label)] + (['color=red', 'penwidth=2'] if name in path else [])
+            lines.append('  "{}" [{}];'.format(name, ', '.join(attributes)))
+
+        for name in self.nodes:
+            for dependency, is_mandatory in self.dependencies(name).items():
+                attributes = ([] if is_mandatory else ['style=dashed']) + (
+                    ['color=red', 'penwidth=2'] if (name, dependency) in critical_edges else []
+                )
+                attributes = ' [{}]'.format(', '.join(attributes)) if attributes else ''
+                lines.append('  "{}" -> "{}"{};'.format(name, dependency, attributes))
+
+        lines.append('}')
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, f=None, format='dot', durations=None, **kw):
+        """Write the graph.
+
+        Args:
+          f: file to write to (standard output by default)
+          format: ``dot`` or ``json``
+          durations: dictionary of the service names -> durations, in seconds
+          **kw: ``json.dump()`` parameters
+        """
+        f = f or sys.stdout
+
+        if format == 'dot':
+            f.write(self.to_dot(durations))
+        elif format == 'json':
+            import json
+
+            json.dump(self.to_dict(durations), f, **dict({'indent': 2}, **kw))
+        else:
+            raise ValueError("invalid graph format '{}', can only be dot, json".format(format))
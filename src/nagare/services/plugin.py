@@ -16,7 +16,7 @@ import logging
 
 from nagare.config import ParameterError, config_from_dict
 
-from . import plugins
+from . import plugins, discovery
 
 
 class Plugin(object):
@@ -28,6 +28,7 @@ class Plugin(object):
     PLUGIN_CATEGORY = 'nagare.plugins'
     CONFIG_SPEC = {'activated': 'boolean(default=True)'}
     LOAD_PRIORITY = 1000  # The plugins are loaded from lowest to highest priority value
+    TAGS = ()  # Capabilities of the plugin, to query the registries on
 
     def __init__(self, name_, dist, **config):
         self.name = name_
@@ -73,9 +74,7 @@ class SelectionPlugin(PluginsPlugin):
         if not config:
             return []
 
-        entries = {
-            name: (dist, entry) for dist, name, entry in PluginsPlugin.iter_entry_points(name, entry_points, config)
-        }
+        entries = discovery.get_entry_points_by_name(entry_points) if entry_points else {}
 
         selector = config.get(cls.SELECTOR)
         if not selector:
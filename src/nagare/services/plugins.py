@@ -13,18 +13,113 @@
 The plugins are read from an entry point and configured from a file
 """
 
-from importlib import metadata
+import re
+import inspect
+import weakref
+import functools
 from collections import OrderedDict
 
-from nagare.config import config_from_dict
-from nagare.packaging import Distribution
+from . import profiling
+from .exceptions import FrozenRegistry
 
-from .reporters import PluginsReporter
+
+class DeferredPlugin(object):
+    """Plugin class imported on first use.
+
+    Its loading priority is declared in the extras of its entry point:
+    ``name = module:Class [load_priority=<integer>]``
+    """
+
+    LOAD_PRIORITY_DECLARATION = re.compile(r'\[.*\bload_priority\s*=\s*(-?\d+)')
+
+    def __init__(self, entry, load_priority):
+        self.entry = entry
+        self.LOAD_PRIORITY = load_priority
+        self.plugin = None
+
+    @classmethod
+    def declared_load_priority(cls, entry):
+        """Read the loading priority declared by an entry point.
+
+        Returns:
+          - the priority or ``None``
+        """
+        declaration = cls.LOAD_PRIORITY_DECLARATION.search(entry.value)
+        return declaration and int(declaration.group(1))
+
+    def load(self):
+        if self.plugin is None:
+            self.plugin = self.entry.load()
+
+        return self.plugin
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return '<deferred plugin {}>'.format(self.entry.value)
+
+
+def load_plugin_class(plugin):
+    """Import the class of a plugin if not already done."""
+    return plugin.load() if isinstance(plugin, DeferredPlugin) else plugin
+
+
+def freeze_spec(spec):
+    """Hashable form of a configuration specification."""
+    return tuple((k, freeze_spec(v) if isinstance(v, dict) else v) for k, v in spec.items())
+
+
+def thaw_spec(frozen_spec):
+    return {k: thaw_spec(v) if isinstance(v, tuple) else v for k, v in frozen_spec}
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_spec(frozen_spec):
+    from nagare.config import config_from_dict
+
+    return config_from_dict(thaw_spec(frozen_spec))
+
+
+def compile_spec(spec):
+    """Create the validation specification object from a configuration specification.
+
+    The specification objects are only read by the validation so they are
+    cached and shared, keyed by the content of the merged specifications.
+
+    In:
+      - ``spec`` -- dictionary of the configuration specification
+
+    Returns:
+      - the validation specification
+    """
+    try:
+        return _compile_spec(freeze_spec(spec))
+    except TypeError:  # Not hashable specification
+        from nagare.config import config_from_dict
+
+        return config_from_dict(spec)
+
+
+class FrozenDict(dict):
+    """Dictionary raising ``FrozenRegistry`` on modification."""
+
+    __slots__ = ()
+
+    def _frozen(self, *args, **kw):
+        raise FrozenRegistry('frozen registry')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _frozen
+
+
+class ActivatedEntries(list):
+    """Entry points of the activated plugins."""
 
 
 class Plugins(object):
     CONFIG_SPEC = {'activated': 'boolean(default=True)'}
     ENTRY_POINTS = None  # Section where to read the entry points
+    profile = None  # Timings of the last plugins loading
 
     def __init__(self, activated_by_default=True):
         """Eager / lazy loading of the plugins.
@@ -34,6 +129,8 @@ class Plugins(object):
         """
         self.activated_by_default = activated_by_default
         self.plugins = OrderedDict()
+        self.generation = 0  # Incremented each time the registry or a nested registry is modified
+        self.containers = weakref.WeakSet()  # Registries to notify of the modifications
 
     @staticmethod
     def load_order(dist, name, entry, plugin):
@@ -62,7 +159,9 @@ class Plugins(object):
             return []
 
         if not distributions:
-            distributions = {dist.metadata['name']: dist for dist in metadata.distributions()}.values()
+            from . import discovery
+
+            return list(discovery.get_entry_points(entry_points))
 
         return [
             (dist, entry.name, entry)
@@ -71,23 +170,57 @@ class Plugins(object):
             if entry.group == entry_points
         ]
 
-    @classmethod
-    def iter_activated_entry_points(cls, name, entry_points, config, global_config, activated_by_default):
-        entries = []
+    @staticmethod
+    def filter_activated_entry_points(entries, config, global_config, activated_by_default):
+        """Keep the entry points of the activated plugins.
+
+        The ``activated`` values of all the plugins are interpolated and
+        validated at once.
+
+        In:
+          - ``entries`` -- list of ``(dist, name, entry)``
+
+        Returns:
+          - the activated entry points
+        """
+        if not entries:
+            return ActivatedEntries()
 
-        for dist, plugin_name, entry in cls.iter_entry_points(name, entry_points, config):
-            spec = config_from_dict({plugin_name: {'activated': 'boolean(default={})'.format(activated_by_default)}})
-            conf = {plugin_name: {'activated': config.get(plugin_name, {}).get('activated', str(activated_by_default))}}
-            conf = config_from_dict(conf).interpolate(global_config).validate(spec)
+        from nagare.config import config_from_dict
 
-            if conf[plugin_name]['activated']:
-                entries.append((dist, plugin_name, entry))
+        names = OrderedDict.fromkeys(name for _, name, _ in entries)
+
+        spec = {name: {'activated': 'boolean(default={})'.format(activated_by_default)} for name in names}
+        conf = {name: {'activated': config.get(name, {}).get('activated', str(activated_by_default))} for name in names}
+        conf = config_from_dict(conf).interpolate(global_config).validate(config_from_dict(spec))
+
+        return ActivatedEntries(entry for entry in entries if conf[entry[1]]['activated'])
+
+    @classmethod
+    def iter_activated_entry_points(cls, name, entry_points, config, global_config, activated_by_default):
+        with profiling.measure('discovery'):
+            entries = cls.iter_entry_points(name, entry_points, config)
 
-        return entries
+        with profiling.measure('activation'):
+            return cls.filter_activated_entry_points(entries, config, global_config, activated_by_default)
 
     @classmethod
     def load_entry_points(cls, entry_points, config):
-        all_plugins = [(dist, name, entry, entry.load()) for dist, name, entry in entry_points]
+        """Load the plugin classes.
+
+        The plugins whose entry points declare their loading priority are not
+        imported but represented by a ``DeferredPlugin``.
+        """
+        all_plugins = []
+        for dist, name, entry in entry_points:
+            load_priority = DeferredPlugin.declared_load_priority(entry)
+            if load_priority is None:
+                with profiling.measure('import', name):
+                    plugin = entry.load()
+            else:
+                plugin = DeferredPlugin(entry, load_priority)
+            all_plugins.append((dist, name, entry, plugin))
+
         all_plugins.sort(key=lambda plugin: cls.load_order(*plugin))
 
         plugins = OrderedDict()
@@ -108,94 +241,183 @@ class Plugins(object):
         """
         return plugin_cls(name_, dist, **config)
 
-    def load_plugins(self, name, config=None, global_config=None, validate=False, entry_points=None):
-        """Load, configure, activate and register the plugin.
+    def _call_hook(self, hook, *args):
+        """Call a lifecycle hook of a plugin.
+
+        In:
+          - ``hook`` -- the hook method
+
+        Returns:
+          - the value returned by the hook
+        """
+        return hook(*args)
+
+    def _select_plugins(self, name, config=None, global_config=None, validate=False, entry_points=None):
+        """Read, activate and configure the plugins to load.
 
         In:
           - ``config`` -- ``ConfigObj`` configuration object
-          - ``config_section`` -- if defined, overloads the ``CONFIG_SECTION`` class attribute
           - ``entry_points`` -- if defined, overloads the ``ENTRY_POINT`` class attribute
-          - ``initial_config`` -- other configuration parameters not read from the configuration file
+
+        Returns:
+          - list of ``(dist, name, plugin class, plugin configuration)``, in loading order
         """
+        entry_points = entry_points or self.ENTRY_POINTS
+
+        self.profile = profiling.LoadingProfile(name, entry_points)
+        with self.profile.activate():
+            return self._select_profiled_plugins(name, config, global_config, validate, entry_points)
+
+    def _select_profiled_plugins(self, name, config, global_config, validate, entry_points):
         config = config or {}
         if type(config) is dict:  # noqa: E721
+            from nagare.config import config_from_dict
+
             config = config_from_dict(config)
 
-        entry_points = entry_points or self.ENTRY_POINTS
         entries = self.iter_activated_entry_points(name, entry_points, config, global_config, self.activated_by_default)
 
         activated_sections = {e[1] for e in entries}
         config.sections = {name: section for name, section in config.sections.items() if name in activated_sections}
 
         if validate:
+            with profiling.measure('validation'):
+                self._validate_config(name, entries, activated_sections, config, global_config)
 
-            def extract_infos(spec):
-                r = {}
+        if type(config) is not dict:  # noqa: E721
+            config = config.dict()
 
-                for f, args in spec:
-                    name, config_spec, children = f(*args)
-                    r[name] = dict(config_spec, **extract_infos(children))
+        plugins = self.load_entry_points(entries, config)
+        return [(dist, name, plugin, config.get(name, {})) for dist, name, entry, plugin in plugins]
 
-                return r
+    def _validate_config(self, name, entries, activated_sections, config, global_config):
+        """Merge the default values and validate the configuration of the plugins.
 
-            spec = self.walk1(name, entries, config, global_config, self.activated_by_default)
-            spec = {name: section for name, section in extract_infos(spec).items() if name in activated_sections}
-            spec = config_from_dict(spec)
+        In:
+          - ``entries`` -- entry points of the activated plugins
+          - ``activated_sections`` -- names of the activated plugins
+          - ``config`` -- configuration object, updated in place
+        """
 
-            config.merge_defaults(spec)
-            config.interpolate(global_config).validate(spec)
+        def extract_infos(spec):
+            r = {}
 
-        if type(config) is not dict:  # noqa: E721
-            config = config.dict()
+            for f, args in spec:
+                name, config_spec, children = f(*args)
+                r[name] = dict(config_spec, **extract_infos(children))
+
+            return r
+
+        spec = self.walk1(name, entries, config, global_config, self.activated_by_default)
+        spec = {name: section for name, section in extract_infos(spec).items() if name in activated_sections}
+        spec = compile_spec(spec)
+
+        config.merge_defaults(spec)
+        config.interpolate(global_config).validate(spec)
+
+    def _instantiate_plugin(self, dist, name, plugin, plugin_config):
+        profile = self.profile
+        if profile is not None:
+            profile.plugin(name).dist = dist
+
+        try:
+            from nagare.packaging import get_location
+
+            dist.location = get_location(dist)
+
+            with profiling.measure('import', name, profile):
+                plugin_cls = load_plugin_class(plugin)
+
+            with profiling.measure('instantiation', name, profile):
+                return self._load_plugin(name, dist, plugin_cls, **plugin_config)
+        except Exception:
+            print("'%s' can't be loaded" % name)
+            raise
+
+    async def _async_instantiate_plugin(self, dist, name, plugin, plugin_config):
+        plugin_instance = self._instantiate_plugin(dist, name, plugin, plugin_config)
+
+        try:
+            with profiling.measure('instantiation', name, self.profile):
+                if inspect.isawaitable(plugin_instance):
+                    plugin_instance = await plugin_instance
+
+                start = getattr(plugin_instance, 'async_start', None)
+                if start is not None:
+                    await self._call_hook(start)
+        except Exception:
+            print("'%s' can't be loaded" % name)
+            raise
+
+        return plugin_instance
+
+    def _register_plugin(self, name, plugin_instance):
+        if plugin_instance is not None:
+            self[name.replace('.', '_')] = plugin_instance
+
+    def load_plugins(self, name, config=None, global_config=None, validate=False, entry_points=None):
+        """Load, configure, activate and register the plugin.
+
+        In:
+          - ``config`` -- ``ConfigObj`` configuration object
+          - ``config_section`` -- if defined, overloads the ``CONFIG_SECTION`` class attribute
+          - ``entry_points`` -- if defined, overloads the ``ENTRY_POINT`` class attribute
+          - ``initial_config`` -- other configuration parameters not read from the configuration file
+        """
+        for dist, name, plugin, plugin_config in self._select_plugins(
+            name, config, global_config, validate, entry_points
+        ):
+            self._register_plugin(name, self._instantiate_plugin(dist, name, plugin, plugin_config))
+
+        return self
+
+    async def async_load_plugins(self, name, config=None, global_config=None, validate=False, entry_points=None):
+        """Load, configure, activate and register the plugin, without blocking the event loop.
+
+        The plugins created by a coroutine are awaited then their optional
+        ``async_start`` hook is awaited, before the next plugin is loaded.
+
+        In:
+          - ``config`` -- ``ConfigObj`` configuration object
+          - ``entry_points`` -- if defined, overloads the ``ENTRY_POINT`` class attribute
+        """
+        for dist, name, plugin, plugin_config in self._select_plugins(
+            name, config, global_config, validate, entry_points
+        ):
+            self._register_plugin(name, await self._async_instantiate_plugin(dist, name, plugin, plugin_config))
 
-        plugins = self.load_entry_points(entries, config)
-        for dist, name, entry, plugin in plugins:
-            try:
-                dist.location = Distribution(dist).editable_project_location or str(dist.locate_file(''))
-
-                plugin_config = config.get(name, {})
-                plugin_instance = self._load_plugin(name, dist, plugin, **plugin_config)
-                if plugin_instance is not None:
-                    self[name.replace('.', '_')] = plugin_instance
-            except Exception:
-                print("'%s' can't be loaded" % name)
-                raise
         return self
 
     @staticmethod
     def _walk(o, name, entry_points, config, global_config, activated_by_default, get_children):
         all_entries = o.iter_entry_points(name, entry_points, config) if isinstance(entry_points, str) else entry_points
 
-        if activated_by_default is None:
+        if (activated_by_default is None) or isinstance(all_entries, ActivatedEntries):
+            # Activation already evaluated (by ``load_plugins``)
             activated_entries = all_entries
         else:
-            activated_entries = []
-
-            for dist, plugin_name, entry in all_entries:
-                spec = config_from_dict(
-                    {plugin_name: {'activated': 'boolean(default={})'.format(activated_by_default)}}
-                )
-                conf = {
-                    plugin_name: {'activated': config.get(plugin_name, {}).get('activated', str(activated_by_default))}
-                }
-                conf = config_from_dict(conf).interpolate(global_config).validate(spec)
-
-                if conf[plugin_name]['activated']:
-                    activated_entries.append((dist, plugin_name, entry))
+            activated_entries = o.filter_activated_entry_points(
+                all_entries, config, global_config, activated_by_default
+            )
 
         for dist, name, entry, cls in o.load_entry_points(activated_entries, config):
+            cls = load_plugin_class(cls)
             plugin = get_children(o, name, cls)
 
             if hasattr(plugin, '_walk'):
-                children = plugin._walk(
-                    plugin,
-                    name,
-                    plugin.ENTRY_POINTS,
-                    config.get(name, {}),
-                    global_config,
-                    activated_by_default,
-                    get_children,
-                )
+                # The plugins of the nested registry are not loaded into this registry
+                with profiling.suspend():
+                    children = list(
+                        plugin._walk(
+                            plugin,
+                            name,
+                            plugin.ENTRY_POINTS,
+                            config.get(name, {}),
+                            global_config,
+                            activated_by_default,
+                            get_children,
+                        )
+                    )
             else:
                 children = []
 
@@ -216,7 +438,7 @@ class Plugins(object):
             self, name, self.ENTRY_POINTS, {}, {}, None, lambda o, name, plugin: o.get(name.replace('.', '_'))
         )
 
-    def report(self, name, title='Plugins', activated_columns=None, criterias=lambda *args: True):
+    def report(self, name, title='Plugins', activated_columns=None, criterias=lambda *args: True, format='text'):
         def extract_infos(plugins, added, level, ancestors):
             infos = []
             for plugin in plugins:
@@ -239,12 +461,12 @@ class Plugins(object):
         plugins = self.walk2(name)
         infos = extract_infos(plugins, set(), 0, ())
 
-        print(title + ':\n')
+        if format == 'text':
+            print(title + ':\n')
 
-        if not infos:
-            print('  <empty>')
-        else:
-            PluginsReporter().report({'name', 'order', 'x'} | (activated_columns or set()), infos, False)
+        from .reporters import PluginsReporter
+
+        PluginsReporter().report({'name', 'order', 'x'} | (activated_columns or set()), infos, False, format=format)
 
     def copy(self, **kw):
         """Create a new copy of this registry.
@@ -258,6 +480,38 @@ class Plugins(object):
 
         return new
 
+    def freeze(self):
+        """Forbid the modifications of this registry and of its nested registries.
+
+        Returns:
+          - the frozen registry
+        """
+        if type(self.plugins) is not FrozenDict:
+            self.plugins = FrozenDict(self.items())
+            for plugin in self.plugins.values():
+                if isinstance(plugin, Plugins):
+                    Plugins.freeze(plugin)  # Frozen in place, without creating a snapshot
+
+            self.changed()
+
+        return self
+
+    def changed(self, notified=None):
+        """Record a modification of this registry or of a nested registry.
+
+        The registries containing this registry are notified.
+
+        In:
+          - ``notified`` -- ids of the registries already notified
+        """
+        self.generation += 1
+
+        notified = notified or set()
+        notified.add(id(self))
+        for container in list(self.containers):
+            if id(container) not in notified:
+                container.changed(notified)
+
     def __len__(self):
         return len(self.plugins)
 
@@ -266,18 +520,24 @@ class Plugins(object):
 
     def __setitem__(self, k, v):
         self.plugins[k] = v
+        self.changed()
 
     def __getitem__(self, k):
         return self.plugins[k]
 
+    def __contains__(self, k):
+        return k in self.plugins
+
     def __delitem__(self, k):
         del self.plugins[k]
+        self.changed()
 
     def get(self, k, v=None):
         return self.plugins.get(k, v)
 
     def update(self, d):
         self.plugins.update(d)
+        self.changed()
 
     def keys(self):
         return list(self.plugins)
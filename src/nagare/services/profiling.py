@@ -0,0 +1,220 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Timings of the plugins loading.
+
+Each ``load_plugins()`` records, on the registry ``profile`` attribute, the
+time spent to discover the entry points, evaluate the activation of the
+plugins and validate their configuration and, for each plugin, the time
+spent to import and to instantiate it. The loading profile of a registry
+created by a plugin is attached to this plugin.
+"""
+
+import sys
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+
+current_profile = contextvars.ContextVar('nagare.services.profile', default=None)
+current_plugin = contextvars.ContextVar('nagare.services.profiled_plugin', default=None)
+current_measure = contextvars.ContextVar('nagare.services.measure', default=None)
+
+
+class PluginProfile(object):
+    """Loading times of a plugin, in seconds."""
+
+    def __init__(self, name):
+        self.name = name
+        self.dist = None
+        self.import_time = 0.0
+        self.instantiation = 0.0
+        self.children = None  # Loading profile of the plugins loaded by this plugin
+
+    @property
+    def total(self):
+        return self.import_time + self.instantiation
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'package': self.dist and self.dist.metadata['name'],
+            'import': self.import_time,
+            'instantiation': self.instantiation,
+            'total': self.total,
+            'children': self.children and self.children.to_dict(),
+        }
+
+
+class LoadingProfile(object):
+    """Loading times of the plugins of a registry, in seconds."""
+
+    PHASES = {'import': 'import_time', 'instantiation': 'instantiation'}
+
+    def __init__(self, name=None, entry_points=None):
+        self.name = name
+        self.entry_points = entry_points
+        self.discovery = 0.0
+        self.activation = 0.0
+        self.validation = 0.0
+        self.plugins = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def total(self):
+        plugins = sum(plugin.total for plugin in self.plugins.values())
+        return self.discovery + self.activation + self.validation + plugins
+
+    def plugin(self, name):
+        with self.lock:
+            plugin = self.plugins.get(name)
+            if plugin is None:
+                plugin = self.plugins[name] = PluginProfile(name)
+
+        return plugin
+
+    def add(self, phase, duration, name=None):
+        """Record a duration.
+
+        Args:
+          phase: ``discovery``, ``activation`` or ``validation`` for the whole registry,
+            ``import`` or ``instantiation`` for a plugin
+          duration: in seconds
+          name: name of the plugin
+        """
+        if name is None:
+            with self.lock:
+                setattr(self, phase, getattr(self, phase) + duration)
+        else:
+            plugin = self.plugin(name)
+            attribute = self.PHASES[phase]
+            with self.lock:
+                setattr(plugin, attribute, getattr(plugin, attribute) + duration)
+
+    @contextmanager
+    def activate(self):
+        """Record the durations measured without explicit profile into this profile."""
+        parent = current_plugin.get()
+        if parent is not None:
+            parent.children = self
+
+        token = current_profile.set(self)
+        try:
+            yield self
+        finally:
+            current_profile.reset(token)
+
+    def sorted_plugins(self):
+        """The plugins profiles, from the most to the least costly."""
+        return sorted(self.plugins.values(), key=lambda plugin: plugin.total, reverse=True)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'entry_points': self.entry_points,
+            'discovery': self.discovery,
+            'activation': self.activation,
+            'validation': self.validation,
+            'total': self.total,
+            'plugins': [plugin.to_dict() for plugin in self.sorted_plugins()],
+        }
+
+    def dump(self, f=None, **kw):
+        """Write the profile as JSON.
+
+        Args:
+          f: file to write to (standard output by default)
+          **kw: ``json.dump()`` parameters
+        """
+        import json
+
+        json.dump(self.to_dict(), f or sys.stdout, **dict({'indent': 2}, **kw))
+
+    def report(self, title='Loading profile', display=None, format='text'):
+        """Display the profile as a table, from the most to the least costly plugins.
+
+        Args:
+          title: title of the ``text`` format
+          display: function called with each line to display
+          format: ``text``, ``stream``, ``csv`` or ``json``
+        """
+        display = display or (lambda m: sys.stdout.write(m + '\n'))
+
+        def extract_infos(profile, level):
+            infos = []
+            for plugin in profile.sorted_plugins():
+                infos.append((plugin.dist, level, plugin))
+                if plugin.children is not None:
+                    infos.extend(extract_infos(plugin.children, level + 1))
+
+            return infos
+
+        if format == 'text':
+            display('{}: {:.2f} ms'.format(title, self.total * 1000))
+            display(
+                '  discovery: {:.2f} ms, activation: {:.2f} ms, validation: {:.2f} ms\n'.format(
+                    self.discovery * 1000, self.activation * 1000, self.validation * 1000
+                )
+            )
+
+        from .reporters import ProfileReporter
+
+        columns = {'name', 'import', 'instantiation', 'total', 'package'}
+        ProfileReporter().report(columns, extract_infos(self, 0), False, display, format=format)
+
+
+@contextmanager
+def measure(phase, name=None, profile=None):
+    """Record the duration of a block.
+
+    The durations of the blocks measured into the same profile while this
+    block runs are not recorded twice: they are not included in the
+    duration of this block.
+
+    Args:
+      phase: ``discovery``, ``activation``, ``validation``, ``import`` or ``instantiation``
+      name: name of the plugin
+      profile: profile to record into (the active profile by default)
+    """
+    profile = profile or current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    parent = current_measure.get()
+    nested = [profile, 0.0]  # Profile of this block, duration of the nested blocks of the same profile
+
+    plugin_token = current_plugin.set(profile.plugin(name)) if phase == 'instantiation' else None
+    measure_token = current_measure.set(nested)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        current_measure.reset(measure_token)
+
+        profile.add(phase, duration - nested[1], name)
+        if (parent is not None) and (parent[0] is profile):
+            parent[1] += duration
+
+        if plugin_token is not None:
+            current_plugin.reset(plugin_token)
+
+
+@contextmanager
+def suspend():
+    """Don't record the durations measured without explicit profile."""
+    token = current_profile.set(None)
+    try:
+        yield
+    finally:
+        current_profile.reset(token)
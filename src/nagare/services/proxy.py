@@ -11,19 +11,68 @@
 import functools
 
 
-def proxy_to(dest, get_target=lambda self: self.proxy_target, blacklist=()):
-    def _(cls):
-        for name in dir(dest):
-            method = getattr(dest, name)
-            if not name.startswith('_') and (name not in blacklist) and callable(method):
+def proxy_to(dest, get_target=lambda self: self.proxy_target, blacklist=(), fast=False):
+    """Class decorator delegating the public methods of a class to a target object.
+
+    In:
+      - ``dest`` -- class of the target
+      - ``get_target`` -- function returning the target of a proxy instance
+      - ``blacklist`` -- names of the methods not to delegate
+      - ``fast`` -- instead of calling the ``dest`` methods through wrappers, the bound methods of the
+        target are retrieved on first access then kept in the proxy instance dictionary. The target of
+        a proxy instance must not change. The methods already defined by the decorated class are still
+        wrapped
+    """
 
-                def _(method):
-                    return functools.update_wrapper(
-                        lambda self, *args, **kw: method(get_target(self), *args, **kw), method
-                    )
+    def create_wrapper(method):
+        return functools.update_wrapper(lambda self, *args, **kw: method(get_target(self), *args, **kw), method)
+
+    def _(cls):
+        names = [
+            name
+            for name in dir(dest)
+            if not name.startswith('_') and (name not in blacklist) and callable(getattr(dest, name))
+        ]
 
-                setattr(cls, name, _(method))
+        for name in names:
+            if fast and not hasattr(cls, name):
+                setattr(cls, name, BoundMethod(name, get_target))
+            else:
+                setattr(cls, name, create_wrapper(getattr(dest, name)))
 
         return cls
 
     return _
+
+
+class BoundMethod(object):
+    """Non-data descriptor binding a target method to the proxy instance on first access.
+
+    The bound method is kept in the instance dictionary, which then takes
+    precedence over this descriptor: the next accesses are plain attribute
+    lookups.
+    """
+
+    __slots__ = ('name', 'get_target')
+
+    def __init__(self, name, get_target):
+        """Initialization.
+
+        In:
+          - ``name`` -- name of the method to bind
+          - ``get_target`` -- function returning the target of a proxy instance
+        """
+        self.name = name
+        self.get_target = get_target
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        method = getattr(self.get_target(instance), self.name)
+
+        instance_attributes = getattr(instance, '__dict__', None)
+        if instance_attributes is not None:
+            instance_attributes[self.name] = method
+
+        return method
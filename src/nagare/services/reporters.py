@@ -8,59 +8,107 @@
 # this distribution.
 # --
 
+import io
+import csv
 import sys
+import json
 
-from nagare.packaging import Distribution
+from nagare.packaging import get_location
 
 
 class Reporter(object):
+    FORMATS = ('text', 'stream', 'csv', 'json')
+
     def __init__(self, columns=()):
         self.columns = columns
 
-    def report(self, activated_columns, to_report, sorted, display=None, indent=0):
+    def report(self, activated_columns, to_report, sorted, display=None, indent=0, format='text'):
+        """Display a table.
+
+        Each cell is extracted only once.
+
+        In:
+          - ``activated_columns`` -- lowercase labels of the columns to display
+          - ``to_report`` -- list of the arguments of the columns ``extract`` functions, one per row
+          - ``sorted`` -- sort the rows
+          - ``display`` -- function called with each line to display (written on the standard output by default)
+          - ``indent`` -- indentation of the ``text`` format
+          - ``format`` -- ``text`` (padded columns), ``stream`` (tab separated cells, a row displayed as soon
+            as extracted if not sorted), ``csv`` or ``json``
+        """
+        if format not in self.FORMATS:
+            raise ValueError("invalid report format '{}', can only be {}".format(format, ', '.join(self.FORMATS)))
+
         display = display or (lambda m: sys.stdout.write(m + '\n'))
-        if not to_report:
+        columns = [column for column in self.columns if column[0].lower() in activated_columns]
+
+        rows = ([extract(*args) for label, extract, left in columns] for args in to_report)
+        if sorted:
+            # Same order as the padded cells: the shortest right justified cells first
+            lefts = [left for label, extract, left in columns]
+            rows = list(rows)
+            rows.sort(key=lambda fields: [f if left else (len(f), f) for f, left in zip(fields, lefts)])
+
+        getattr(self, 'report_' + format)(columns, rows, display, indent)
+
+    @staticmethod
+    def report_text(columns, rows, display, indent):
+        rows = list(rows)
+        if not rows:
             display('  <empty>')
             return
 
-        columns = [list(column) for column in self.columns if column[0].lower() in activated_columns]
+        paddings = [len(label) for label, extract, left in columns]
+        for fields in rows:
+            paddings = [max(padding, len(field)) for padding, field in zip(paddings, fields)]
 
-        for column in columns:
-            label, extract, left = column
-            padding = max(len(extract(*args)) for args in to_report)
-            column.append(max((padding, len(label))))
+        indent = ' ' * indent
+        justifications = [(str.ljust if left else str.rjust) for label, extract, left in columns]
 
-        labels = [(label.ljust if left else label.rjust)(padding) for label, extract, left, padding in columns]  # noqa: F812
-        display((' ' * indent) + ' '.join(labels))
-        labels = ['-' * padding for label, extract, left, padding in columns]
-        display((' ' * indent) + ' '.join(labels))
+        def render(fields):
+            return indent + ' '.join(justify(field, n) for justify, field, n in zip(justifications, fields, paddings))
 
-        rows = []
-        for args in to_report:
-            fields = []
-            for label, extract, left, padding in columns:
-                field = extract(*args)
-                field = (field.ljust if left else field.rjust)(padding)
-                fields.append(field)
+        display(render([label for label, extract, left in columns]))
+        display(indent + ' '.join('-' * padding for padding in paddings))
 
-            rows.append(fields)
+        for fields in rows:
+            display(render(fields))
 
-        if sorted:
-            rows.sort()
+    @staticmethod
+    def report_stream(columns, rows, display, indent):
+        display('\t'.join(label for label, extract, left in columns))
+
+        for fields in rows:
+            display('\t'.join(fields))
+
+    @staticmethod
+    def report_csv(columns, rows, display, indent):
+        line = io.StringIO()
+        writer = csv.writer(line, lineterminator='')
+
+        def render(fields):
+            line.seek(0)
+            line.truncate()
+            writer.writerow(fields)
+
+            return line.getvalue()
+
+        display(render([label for label, extract, left in columns]))
 
         for fields in rows:
-            display((' ' * indent) + ' '.join(fields))
+            display(render(fields))
+
+    @staticmethod
+    def report_json(columns, rows, display, indent):
+        labels = [label for label, extract, left in columns]
+        display(json.dumps([dict(zip(labels, fields)) for fields in rows], indent=indent or None))
 
 
 class PackagesReporter(Reporter):
     COLUMNS = (
         ('Package', lambda dist, *args: dist.metadata['name'], True),
         ('Version', lambda dist, *args: dist.metadata['version'], True),
-        (
-            'Location',
-            lambda dist, *args: Distribution(dist).editable_project_location or str(dist.locate_file('')),
-            True,
-        ),
+        ('Location', lambda dist, *args: get_location(dist), True),
     )
 
     def __init__(self, columns=None):
@@ -97,3 +145,16 @@ class PluginsReporter(PackagesReporter):
     @staticmethod
     def extract_description(plugin, activated_plugin):
         return (plugin if activated_plugin is None else activated_plugin).DESC
+
+
+class ProfileReporter(Reporter):
+    COLUMNS = (
+        ('Name', lambda dist, level, plugin: ' ' * (4 * level) + plugin.name, True),
+        ('Import', lambda dist, level, plugin: '{:.2f}'.format(plugin.import_time * 1000), False),
+        ('Instantiation', lambda dist, level, plugin: '{:.2f}'.format(plugin.instantiation * 1000), False),
+        ('Total', lambda dist, level, plugin: '{:.2f}'.format(plugin.total * 1000), False),
+        ('Package', lambda dist, level, plugin: dist.metadata['name'] if dist is not None else '', True),
+    )
+
+    def __init__(self, columns=None):
+        super(ProfileReporter, self).__init__(columns or self.COLUMNS)
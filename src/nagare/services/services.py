@@ -10,14 +10,26 @@
 # --
 
 """Services registry."""
+import gc
+import os
+import time
 import inspect
+import keyword
+import weakref
 import functools
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict
 
 try:
     from inspect import Parameter, signature
 
     POSITIONAL_OR_KEYWORD = Parameter.POSITIONAL_OR_KEYWORD
     KEYWORD_ONLY = Parameter.KEYWORD_ONLY
+    POSITIONAL_ONLY = Parameter.POSITIONAL_ONLY
+    VAR_POSITIONAL = Parameter.VAR_POSITIONAL
+    VAR_KEYWORD = Parameter.VAR_KEYWORD
     EMPTY = Parameter.empty
 
     PY_VERSION = 3
@@ -26,10 +38,201 @@ except ImportError:
 
     PY_VERSION = 2
 
-from . import plugins, exceptions
+from . import graph, plugins, exceptions
+
+INJECTOR_TEMPLATE = """
+def create_injector(_f_, _registry_, _scope_, _refresh_, _inject_, _generation_, {values}):
+    def injector({parameters}):
+        if (_registry_.generation == _generation_) and (_scope_() is None):
+            return _f_({arguments})
+        return _refresh_(({positionals}), {{{keywords}}}, {{{injected}}})
+    return injector
+"""
+
+_INJECT = object()  # Marker of the dependencies not explicitly passed
+
+current_scope = contextvars.ContextVar('nagare.services.scope', default=None)
+
+
+def walk_service_path(registry, service_path):
+    """Retrieve a service by walking down the nested registries.
+
+    Args:
+      registry: the top registry
+      service_path: names of the nested registries then of the service
+
+    Return:
+      the service
+    """
+    return functools.reduce(lambda d, name: d[name], service_path, registry)
+
+
+def mark_coroutine_function(injector, f):
+    """Keep the injector of a coroutine function recognized as a coroutine function.
+
+    The injector directly returns the coroutine created by ``f``, without
+    wrapping it into another coroutine. It's recognized by ``asyncio`` and,
+    from Python 3.12, by ``inspect``.
+    """
+    if inspect.iscoroutinefunction(f):
+        if hasattr(inspect, 'markcoroutinefunction'):
+            inspect.markcoroutinefunction(injector)
+        else:
+            from asyncio import coroutines
+
+            injector._is_coroutine = coroutines._is_coroutine
+
+    return injector
+
+
+class InjectionPlans(object):
+    """Bounded LRU cache of the injection plans, weakly keyed by the callables.
+
+    An injection plan is the tuple of ``(name, is_mandatory)`` of the parameters to inject
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.plans = OrderedDict()  # ``id(f)`` -> (weak reference to ``f``, plan)
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.plans)
+
+    def get(self, f, create_plan):
+        """Retrieve the injection plan of a callable.
+
+        Args:
+          f: the callable
+          create_plan: function called to create the plan of ``f`` when not in cache
+
+        Return:
+          the injection plan
+        """
+        # The bound methods are ephemeral objects: their plan is cached on the underlying function
+        key = f.__func__ if inspect.ismethod(f) else f
+
+        entry = self.plans.get(id(key))
+        if (entry is not None) and (entry[0]() is key):
+            self.hits += 1
+            try:  # noqa: SIM105 (``contextlib.suppress()`` is 10 times slower on this hot path)
+                self.plans.move_to_end(id(key))
+            except KeyError:  # Concurrently evicted
+                pass
+
+            return entry[1]
+
+        self.misses += 1
+        plan = create_plan(f)
+
+        try:
+            ref = weakref.ref(key, functools.partial(self.discard, id(key)))
+        except TypeError:  # Not weak referenceable callable (i.e builtin)
+            return plan
+
+        with self.lock:
+            self.plans[id(key)] = (ref, plan)
+            while len(self.plans) > self.size:
+                self.plans.popitem(last=False)
+
+        return plan
+
+    def discard(self, key, ref):
+        with self.lock:
+            if self.plans.get(key, (None,))[0] is ref:
+                del self.plans[key]
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
+            self.hits = self.misses = 0
+
+
+class LazyService(object):
+    """Placeholder of a service instantiated on first use."""
+
+    __slots__ = ('dist', 'name', 'service_cls', 'config', 'lock', 'instantiating')
+
+    def __init__(self, dist, name, service_cls, config):
+        self.dist = dist
+        self.name = name
+        self.service_cls = service_cls
+        self.config = config
+        self.lock = threading.RLock()
+        self.instantiating = False
+
+    def __repr__(self):
+        return '<lazy service {}>'.format(self.name)
+
+
+class ServicesIndex(object):
+    """Secondary indexes of the services, by classes and base classes, categories and tags."""
+
+    def __init__(self, resolve=lambda location: location):
+        """Initialization.
+
+        Args:
+          resolve: function returning the service from its location
+        """
+        self.resolve = resolve
+        self.classes = {}  # class -> {dotted path: location}
+        self.categories = {}  # ``PLUGIN_CATEGORY`` -> {dotted path: location}
+        self.tags = {}  # tag -> {dotted path: location}
+
+    def add(self, path, location, service_cls, category, tags):
+        """Index a service.
+
+        Args:
+          path: dotted path of the service
+          location: location of the service, given to ``resolve``
+          service_cls: class of the service
+          category: ``PLUGIN_CATEGORY`` of the service
+          tags: capabilities declared by the service
+        """
+        for cls in inspect.getmro(service_cls):
+            self.classes.setdefault(cls, {})[path] = location
+
+        if category is not None:
+            self.categories.setdefault(category, {})[path] = location
+
+        for tag in tags:
+            self.tags.setdefault(tag, {})[path] = location
+
+    def query(self, cls=None, category=None, tag=None):
+        """Retrieve the services matching all the criterias.
+
+        Args:
+          cls: class or base class of the services
+          category: ``PLUGIN_CATEGORY`` of the services
+          tag: capability declared by the services
+
+        Return:
+          dictionary of the dotted paths -> services
+        """
+        matches = [
+            index.get(value, {})
+            for index, value in ((self.classes, cls), (self.categories, category), (self.tags, tag))
+            if value is not None
+        ]
+        if not matches:
+            matches = [self.classes.get(object, {})]
+
+        matches.sort(key=len)
+        smallest, others = matches[0], matches[1:]
+
+        return {
+            path: self.resolve(location)
+            for path, location in smallest.items()
+            if all(path in other for other in others)
+        }
 
 
 class Services(plugins.Plugins):
+    PLANS_CACHE_SIZE = 1024  # Max number of callables whose injection plan is cached
+    fork_hooks_registered = False
+    reload_report = None  # Close hooks of the services replaced or removed by the last reloading
+
     def __init__(self, activated_by_default=True, dependencies_postfix='service'):
         """Eager / lazy loading of the services.
 
@@ -41,6 +244,11 @@ class Services(plugins.Plugins):
           - ``initial_config`` -- other configuration parameters not read from the configuration file
         """
         self.postfix = '_' + dependencies_postfix
+        self.plans = InjectionPlans(self.PLANS_CACHE_SIZE)
+        self.paths = None  # Index of the services paths, built on demand
+        self.index = None  # Secondary indexes of the services, built on demand
+        self.selection = OrderedDict()  # Services of the last loading, with their configuration
+        self._dependency_graph = None  # Dependencies between the services of the last loading, built on demand
         super(Services, self).__init__(activated_by_default)
 
     def _load_plugin(self, name_, dist, service_cls, activated=None, **config):
@@ -55,11 +263,770 @@ class Services(plugins.Plugins):
         service_cls.PLUGIN_CATEGORY = self.ENTRY_POINTS
         return self(service_cls, name_, dist, **config)
 
-    def load_services(self, name, config=None, global_config=None, validate=False, entry_points=None):
-        return self.load_plugins(name, config, global_config, validate, entry_points)
+    def _call_hook(self, hook, *args):
+        return self(hook, *args)
+
+    def _select_plugins(self, name, config=None, global_config=None, validate=False, entry_points=None):
+        services = super(Services, self)._select_plugins(name, config, global_config, validate, entry_points)
+
+        self.selection = OrderedDict((service[1].replace('.', '_'), service) for service in services)
+        self._dependency_graph = None
+
+        if validate:
+            self.check_dependency_graph(self.dependency_graph, list(self.selection), True)
+
+        return services
+
+    @property
+    def dependency_graph(self):
+        """Dependencies graph of the services of the last loading, built on first access.
+
+        The deferred services not imported yet have no dependencies.
+        """
+        if self._dependency_graph is None:
+            self._dependency_graph = self.create_dependency_graph(self.selection.values(), import_deferred=False)
+
+        return self._dependency_graph
+
+    def create_dependency_graph(self, services, import_deferred=True):
+        """Create the dependencies graph from the constructor signatures of the services.
+
+        Args:
+          services: list of ``(dist, name, service class, service configuration)``
+          import_deferred: import the classes of the deferred services to read their constructor signature,
+            else the deferred services not imported yet have no dependencies
+
+        Return:
+          the dependencies graph
+        """
+        dependencies = graph.DependencyGraph()
+
+        for dist, name, service_cls, config in services:
+            if isinstance(service_cls, plugins.DeferredPlugin) and (service_cls.plugin is None) and not import_deferred:
+                plan = ()
+            else:
+                plan = self.get_injection_plan(plugins.load_plugin_class(service_cls))
+
+            dependencies.add(
+                name.replace('.', '_'),
+                ((dependency[: -len(self.postfix)], is_mandatory) for dependency, is_mandatory in plan),
+            )
+
+        return dependencies
+
+    def check_dependency_graph(self, dependencies, order=(), mandatory_only=False):
+        """Check the services have no circular dependencies and are loaded after their dependencies.
+
+        Args:
+          dependencies: the dependencies graph
+          order: the service names, in loading order (if empty, only the circular dependencies are checked)
+          mandatory_only: only the mandatory dependencies must be loaded before, the optional ones loaded
+            after are logged (and not injected)
+
+        Raises:
+          exceptions.BadConfiguration: circular dependencies or priority inversion
+        """
+        cycle = dependencies.find_cycle()
+        if cycle:
+            raise exceptions.BadConfiguration('circular dependencies between services: ' + ' -> '.join(cycle))
+
+        for name, dependency, is_mandatory in dependencies.check_order(order):
+            if is_mandatory or not mandatory_only:
+                raise exceptions.BadConfiguration(
+                    "service '{}' is loaded before its dependency '{}', check their `LOAD_PRIORITY`".format(
+                        name, dependency
+                    )
+                )
+
+            import logging  # Only imported on the rare priority inversions
+
+            logging.getLogger('nagare.services').warning(
+                "service '%s' is loaded before its optional dependency '%s', check their `LOAD_PRIORITY`",
+                name,
+                dependency,
+            )
+
+    def _instantiate_concurrently(self, services, max_workers):
+        """Instantiate the services on a threads pool, following their dependencies graph.
+
+        Args:
+          services: list of ``(dist, name, service class, service configuration)``, in loading order
+          max_workers: maximum number of threads
+        """
+        from concurrent import futures
+
+        dependencies = self.create_dependency_graph(services)
+        self.check_dependency_graph(dependencies, [name.replace('.', '_') for _, name, _, _ in services])
+
+        services = OrderedDict((service[1].replace('.', '_'), service) for service in services)
+        waiting = OrderedDict((name, set(dependencies.dependencies(name))) for name in services)
+        running = {}
+
+        with futures.ThreadPoolExecutor(max_workers) as executor:
+            while waiting or running:
+                for name in [name for name, needed in waiting.items() if not needed]:
+                    del waiting[name]
+                    running[executor.submit(self._instantiate_plugin, *services[name])] = name
+
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self._register_plugin(services[name][1], future.result())
+
+                    for needed in waiting.values():
+                        needed.discard(name)
+
+        # Same services order than a sequential loading
+        for name in services:
+            if name in self.plugins:
+                self.plugins.move_to_end(name)
+
+    def _register_lazily(self, services):
+        """Register placeholders, instantiating the services on first use.
+
+        Args:
+          services: list of ``(dist, name, service class, service configuration)``, in loading order
+        """
+        self.check_dependency_graph(self.dependency_graph)
+
+        for dist, name, service_cls, config in services:
+            self._register_plugin(name, LazyService(dist, name, service_cls, config))
+
+    def _materialize(self, k, service):
+        """Instantiate the service of a placeholder, with its dependencies, and register it.
+
+        Args:
+          k: name of the service in this registry
+          service: the placeholder
+
+        Return:
+          the service (``None`` if the service can't be registered)
+        """
+        with service.lock:
+            instance = self.plugins.get(k)
+            if instance is not service:  # Already instantiated by an other thread
+                return instance
+
+            if service.instantiating:
+                raise exceptions.BadConfiguration("circular dependencies with service '{}'".format(service.name))
+
+            service.instantiating = True
+            try:
+                instance = self._instantiate_plugin(service.dist, service.name, service.service_cls, service.config)
+            finally:
+                service.instantiating = False
+
+            if instance is None:
+                del self[k]
+            else:
+                self.plugins[k] = instance
+                if isinstance(instance, plugins.Plugins):
+                    self.changed()  # The services of the new nested registry are to be indexed
+
+        return instance
+
+    def materialize(self):
+        """Instantiate all the services still not instantiated."""
+        for k, service in list(self.plugins.items()):
+            if type(service) is LazyService:
+                self._materialize(k, service)
+
+    def pending_services(self):
+        """Names of the services still not instantiated."""
+        return [k for k, service in self.plugins.items() if type(service) is LazyService]
+
+    def load_services(
+        self, name, config=None, global_config=None, validate=False, entry_points=None, max_workers=None, lazy=False
+    ):
+        """Load, configure, activate and register the services.
+
+        Args:
+          name: name of the registry
+          config: ``ConfigObj`` configuration object
+          global_config: variables used to interpolate the configuration
+          validate: validate the configuration of the services against their ``CONFIG_SPEC``
+            and their loading order against their dependencies
+          entry_points: if defined, overloads the ``ENTRY_POINT`` class attribute
+          max_workers: if defined, the independent services are instantiated concurrently by this number of threads
+          lazy: a service is instantiated only when first retrieved from the registry
+
+        Return:
+          the registry
+        """
+        if not (max_workers or lazy):
+            return self.load_plugins(name, config, global_config, validate, entry_points)
+
+        services = self._select_plugins(name, config, global_config, validate, entry_points)
+        if lazy:
+            self._register_lazily(services)
+        else:
+            self._instantiate_concurrently(services, max_workers)
+
+        return self
+
+    @staticmethod
+    def is_same_service(service1, service2):
+        """Check if two selected services have the same class and configuration."""
+        dist1, name1, service_cls1, config1 = service1
+        dist2, name2, service_cls2, config2 = service2
+
+        if isinstance(service_cls1, plugins.DeferredPlugin) and isinstance(service_cls2, plugins.DeferredPlugin):
+            same_cls = service_cls1.entry.value == service_cls2.entry.value
+        else:
+            same_cls = service_cls1 is service_cls2
+
+        return same_cls and (config1 == config2)
+
+    def reload_services(
+        self,
+        name,
+        config=None,
+        global_config=None,
+        validate=False,
+        entry_points=None,
+        timeout=None,
+        global_timeout=None,
+    ):
+        """Reconfigure the services, reconstructing only the ones whose configuration changed.
+
+        The new, reconfigured and removed services are compared to the last
+        loading. The services depending on them are reconstructed too. All
+        the new instances are created before being swapped in this registry,
+        so nothing is changed if one of them can't be created.
+
+        Then the ``close`` hooks of the replaced and removed instances are
+        called, as by ``shutdown()``. Their report is kept in ``reload_report``.
+
+        Args:
+          name: name of the registry
+          config: ``ConfigObj`` configuration object
+          global_config: variables used to interpolate the configuration
+          validate: validate the configuration of the services against their ``CONFIG_SPEC``
+            and their loading order against their dependencies
+          entry_points: if defined, overloads the ``ENTRY_POINT`` class attribute
+          timeout: maximum duration of each ``close`` hook, in seconds
+          global_timeout: maximum duration of all the ``close`` hooks, in seconds
+
+        Return:
+          names of the reconstructed services, in loading order
+        """
+        old_services, old_dependencies = self.selection, self._dependency_graph
+        services = OrderedDict(
+            (service[1].replace('.', '_'), service)
+            for service in self._select_plugins(name, config, global_config, validate, entry_points)
+        )
+        new_dependencies = self._dependency_graph
+        # Until the new services are swapped in
+        self.selection, self._dependency_graph = old_services, old_dependencies
+
+        removed = [k for k in old_services if k not in services]
+        changed = [
+            k
+            for k, service in services.items()
+            if (k not in old_services) or not self.is_same_service(old_services[k], service)
+        ]
+
+        dependencies = self.create_dependency_graph(list(services.values()) + [old_services[k] for k in removed])
+        to_reconstruct = set(changed) | (dependencies.all_dependents(changed + removed) - set(removed))
+        to_reconstruct = [k for k in services if k in to_reconstruct]
+
+        reconstructed = self.scope()
+        with reconstructed:
+            for k in to_reconstruct:
+                dist, service_name, service_cls, service_config = services[k]
+
+                # The removed services are still in this registry, they are not injected
+                for dependency, is_mandatory in dependencies.nodes[k].items():
+                    if dependency in removed:
+                        if is_mandatory:
+                            raise exceptions.MissingService(dependency + self.postfix)
+
+                        service_config = dict(service_config, **{dependency + self.postfix: None})
+
+                instance = self._instantiate_plugin(dist, service_name, service_cls, service_config)
+                if instance is not None:
+                    reconstructed[k] = instance
+
+        old_instances = OrderedDict((k, self.plugins[k]) for k in removed + to_reconstruct if k in self.plugins)
+
+        for k in removed + [k for k in to_reconstruct if k not in reconstructed.plugins]:
+            self.plugins.pop(k, None)
+
+        self.update(reconstructed.plugins)
+        self.selection, self._dependency_graph = services, new_dependencies
+
+        self.reload_report = self.shutdown(timeout, global_timeout, services=old_instances)
+
+        return to_reconstruct
+
+    def construction_times(self):
+        """Import and instantiation times of the services of the last loading.
+
+        Return:
+          dictionary of the service names -> durations, in seconds
+        """
+        profile = self.profile
+        if profile is None:
+            return {}
+
+        return {name.replace('.', '_'): plugin.total for name, plugin in list(profile.plugins.items())}
+
+    def critical_path(self):
+        """Chain of dependent services bounding the loading time of the services.
+
+        The independent services can be instantiated concurrently but each one
+        only after its dependencies, so the services of this chain are the
+        ones to optimise or to load lazily.
+
+        Return:
+          ``(duration in seconds, list of the service names)``, the dependencies first
+        """
+        return self.dependency_graph.critical_path(self.construction_times())
+
+    def dump_dependency_graph(self, f=None, format='dot', **kw):
+        """Write the dependencies graph of the services, with their construction times and the critical path.
+
+        Args:
+          f: file to write to (standard output by default)
+          format: ``dot`` or ``json``
+          **kw: ``json.dump()`` parameters
+        """
+        self.dependency_graph.dump(f, format, self.construction_times(), **kw)
+
+    def async_load_services(self, name, config=None, global_config=None, validate=False, entry_points=None):
+        return self.async_load_plugins(name, config, global_config, validate, entry_points)
+
+    def _instances_graph(self, services=None):
+        """Dependencies graph of the instantiated services.
+
+        Args:
+          services: dictionary of the names -> instances (the services of this registry by default)
+        """
+        if services is None:
+            services = self.plugins
+            selection = self.selection
+        else:
+            selection = {}
+
+        return self.create_dependency_graph(
+            (None, k, selection[k][2] if k in selection else type(service), None)
+            for k, service in services.items()
+            if type(service) is not LazyService
+        )
+
+    def _shutdown_order(self, prefix='', dependents=(), services=None):
+        """Services to close, each one waiting for the services depending on it.
+
+        The services of a nested registry are closed after the services
+        depending on the registry and before the services it depends on.
+
+        Args:
+          prefix: prefix of the service names
+          dependents: names of the services all the services wait for
+          services: dictionary of the names -> instances (the services of this registry by default)
+
+        Return:
+          tuple (dictionary of the instantiated service names -> (their registry, service),
+          dictionary of the instantiated service names -> set of their dependent service names)
+        """
+        instances = self.plugins if services is None else services
+        dependencies = self._instances_graph(services)
+
+        services, waiting = OrderedDict(), OrderedDict()
+        for name in dependencies:
+            service = instances.get(name)
+            full_name = prefix + name
+
+            services[full_name] = (self, service)
+            waiting[full_name] = {prefix + dependent for dependent in dependencies.dependents(name)}
+            waiting[full_name].update(dependents)
+
+            if isinstance(service, Services):
+                nested_services, nested_waiting = service._shutdown_order(full_name + '.', waiting[full_name])
+                services.update(nested_services)
+                waiting.update(nested_waiting)
+                # The registry is released when all its services are closed
+                waiting[full_name].update(nested_waiting)
+
+        return services, waiting
+
+    @staticmethod
+    def _start_hook(registry, hook):
+        """Call a hook in a daemon thread, abandoned if the process exits before its end.
+
+        Args:
+          registry: registry calling the hook
+          hook: the hook
+
+        Return:
+          ``concurrent.futures.Future`` of the hook result
+        """
+        from concurrent import futures
+
+        future = futures.Future()
+
+        def call_hook():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(registry._call_hook(hook))
+                except BaseException as error:
+                    future.set_exception(error)
+
+        threading.Thread(target=call_hook, name='shutdown', daemon=True).start()
+
+        return future
+
+    def _call_hooks(self, hook_name, reverse=False):
+        """Call a hook of the instantiated services, the dependencies first.
+
+        Args:
+          hook_name: name of the optional hook method
+          reverse: the dependent services first
+        """
+        for name in self._instances_graph().topological_order(reverse):
+            hook = getattr(self.plugins.get(name), hook_name, None)
+            if hook is not None:
+                self._call_hook(hook)
+
+    def before_fork(self):
+        """Call the ``before_fork`` hooks of the services, the dependent services first."""
+        self._call_hooks('before_fork', reverse=True)
+
+    def after_fork_child(self):
+        """Call the ``after_fork_child`` hooks of the services in the new process, the dependencies first."""
+        self._call_hooks('after_fork_child')
+
+    def prefork(self, register_at_fork=True):
+        """Prepare the registry to be shared with forked worker processes.
+
+        The lazy services are instantiated. Then all the objects of the
+        process are moved out of the garbage collector generations
+        (``gc.freeze()``) so that the collections in the workers don't write
+        into the memory pages shared with the master process.
+
+        Args:
+          register_at_fork: call ``before_fork()`` and ``after_fork_child()`` on each ``os.fork()``
+        """
+        self.materialize()
+
+        if register_at_fork and not self.fork_hooks_registered and hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self.before_fork, after_in_child=self.after_fork_child)
+            self.fork_hooks_registered = True
+
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    @staticmethod
+    def _closed(report, waiting, name, status, started, error=None):
+        """Record the end of a ``close`` hook and release the services it depends on."""
+        report[name] = {'status': status, 'duration': time.perf_counter() - started, 'error': error}
+
+        for dependents in waiting.values():
+            dependents.discard(name)
+
+    def shutdown(self, timeout=None, global_timeout=None, max_workers=None, services=None):
+        """Call the ``close`` hooks of the services, the dependent services first.
+
+        The independent hooks are called concurrently in daemon threads. A hook
+        exceeding its deadline is abandoned, not interrupted, and the services
+        it depends on are then closed. An abandoned hook doesn't delay the exit
+        of the process.
+
+        The services of the nested registries are closed too.
+
+        Args:
+          timeout: maximum duration of each hook, in seconds
+          global_timeout: maximum duration of the whole shutdown, in seconds
+          max_workers: maximum number of hooks running concurrently
+          services: dictionary of the names -> instances to close (the services of this registry by default)
+
+        Return:
+          dictionary of the names of the services with a hook -> ``{'status': ..., 'duration': ..., 'error': ...}``,
+          the status being ``closed``, ``failed``, ``timeout`` or ``skipped`` (global deadline exceeded)
+        """
+        from concurrent import futures
+
+        deadline = None if global_timeout is None else time.perf_counter() + global_timeout
+        services, waiting = self._shutdown_order(services=services)
+        report = OrderedDict()
+        pending = []  # names of the hooks to start
+        running = {}  # future -> name
+        started = {}  # name -> start time of the hook
+
+        while waiting or pending or running:
+            ready = [name for name, dependents in waiting.items() if not dependents]
+            for name in ready:
+                del waiting[name]
+
+                if hasattr(services[name][1], 'close'):
+                    pending.append(name)
+                else:
+                    for dependents in waiting.values():
+                        dependents.discard(name)
+
+            while pending and ((max_workers is None) or (len(running) < max_workers)):
+                name = pending.pop(0)
+                registry, service = services[name]
+
+                started[name] = time.perf_counter()
+                running[self._start_hook(registry, service.close)] = name
+
+            if ready and not running:
+                continue
+
+            if not running:  # Circular dependencies
+                break
+
+            now = time.perf_counter()
+            deadlines = [deadline] if deadline is not None else []
+            if timeout is not None:
+                deadlines.extend(started[name] + timeout for name in running.values())
+
+            done, _ = futures.wait(
+                running,
+                timeout=max(0, min(deadlines) - now) if deadlines else None,
+                return_when=futures.FIRST_COMPLETED,
+            )
+
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                self._closed(report, waiting, name, 'failed' if error else 'closed', started[name], error)
+
+            now = time.perf_counter()
+            for future, name in list(running.items()):
+                if (timeout is not None) and (now - started[name] >= timeout):
+                    del running[future]
+                    self._closed(report, waiting, name, 'timeout', started[name])
+
+            if (deadline is not None) and (now >= deadline):
+                for name in running.values():
+                    self._closed(report, waiting, name, 'timeout', started[name])
+
+                break
+
+        for name in pending + list(waiting):
+            if hasattr(services[name][1], 'close'):
+                report[name] = {'status': 'skipped', 'duration': 0.0, 'error': None}
+
+        return report
+
+    async def async_shutdown(self, timeout=None, global_timeout=None):
+        """Call the ``async_close`` or ``close`` hooks of the services, the dependent services first.
+
+        The independent hooks are called concurrently on the event loop, the
+        ``close`` hooks in daemon threads. A hook exceeding its deadline is
+        cancelled or, for a ``close`` hook, abandoned without delaying the
+        closing of the event loop nor the exit of the process.
+
+        The services of the nested registries are closed too.
+
+        Args:
+          timeout: maximum duration of each hook, in seconds
+          global_timeout: maximum duration of the whole shutdown, in seconds
+
+        Return:
+          dictionary of the names of the services with a hook -> ``{'status': ..., 'duration': ..., 'error': ...}``,
+          the status being ``closed``, ``failed``, ``timeout`` or ``skipped`` (global deadline exceeded)
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        deadline = None if global_timeout is None else time.perf_counter() + global_timeout
+        services, waiting = self._shutdown_order()
+        report = OrderedDict()
+        running = {}  # task -> name
+
+        def get_hook(name):
+            registry, service = services[name]
+
+            hook = getattr(service, 'async_close', None)
+            if hook is not None:
+                return lambda: registry._call_hook(hook)
+
+            hook = getattr(service, 'close', None)
+            if hook is not None:
+                return lambda: asyncio.wrap_future(self._start_hook(registry, hook), loop=loop)
+
+            return None
+
+        async def close(name, hook):
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(hook(), timeout)
+            except asyncio.TimeoutError:
+                self._closed(report, waiting, name, 'timeout', started)
+            except asyncio.CancelledError:
+                self._closed(report, waiting, name, 'timeout', started)
+                raise
+            except Exception as error:
+                self._closed(report, waiting, name, 'failed', started, error)
+            else:
+                self._closed(report, waiting, name, 'closed', started)
+
+        while waiting or running:
+            ready = [name for name, dependents in waiting.items() if not dependents]
+            for name in ready:
+                del waiting[name]
+
+                hook = get_hook(name)
+                if hook is None:
+                    for dependents in waiting.values():
+                        dependents.discard(name)
+                else:
+                    running[loop.create_task(close(name, hook))] = name
+
+            if ready and not running:
+                continue
+
+            if not running:  # Circular dependencies
+                break
+
+            remaining = None if deadline is None else max(0, deadline - time.perf_counter())
+            done, _ = await asyncio.wait(running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                del running[task]
+
+            if not done:  # Global deadline exceeded
+                for task in running:
+                    task.cancel()
+                await asyncio.wait(running)
+
+                break
+
+        for name in waiting:
+            if get_hook(name) is not None:
+                report[name] = {'status': 'skipped', 'duration': 0.0, 'error': None}
+
+        return report
+
+    def scope(self, **services):
+        """Create a child registry overlaying services on this registry, without copying it.
+
+        The child registry can be activated, as a context manager, for the
+        functions decorated by the ``inject`` method of this registry.
+
+        Args:
+          **services: names and services to add or override
+
+        Return:
+          the child registry
+        """
+        return ScopedServices(self, **services)
+
+    def current(self):
+        """Return the active child registry of this registry or itself."""
+        scope = current_scope.get()
+        if scope is not None:
+            for parent in scope.parents:
+                if parent is self:
+                    return scope
+
+        return self
+
+    def changed(self, notified=None):
+        self.paths = self.index = None
+        super(Services, self).changed(notified)
+
+    def index_paths(self):
+        """Index the services of this registry and of its nested registries by their dotted paths.
+
+        The nested registries are registered to notify this registry of their
+        modifications.
+
+        Return:
+          dictionary of the dotted paths -> ``(registry, name)``
+        """
+        paths = {}
+
+        to_index = [('', self)]
+        indexed = set()
+        while to_index:
+            prefix, registry = to_index.pop(0)
+            indexed.add(id(registry))
+
+            for name, service in registry.plugins.items():
+                paths[prefix + name] = (registry, name)
+
+                nested = isinstance(service, plugins.Plugins) and not isinstance(service, ScopedServices)
+                if nested and (id(service) not in indexed):
+                    service.containers.add(registry)
+                    to_index.append((prefix + name + '.', service))
+
+        return paths
+
+    def get_paths(self):
+        """Retrieve the index of the services paths, building it if needed."""
+        paths = self.paths
+        if paths is None:
+            paths = self.paths = self.index_paths()
+
+        return paths
+
+    def index_services(self):
+        """Index the services of this registry and of its nested registries.
+
+        The lazy services are not instantiated but their classes are imported.
+
+        Return:
+          the secondary indexes
+        """
+        index = ServicesIndex(lambda location: location[0][location[1]])
+
+        for path, (registry, name) in self.get_paths().items():
+            service = registry.plugins[name]
+
+            if type(service) is LazyService:
+                service = plugins.load_plugin_class(service.service_cls)
+                service_cls = service
+                category = registry.ENTRY_POINTS  # Category given to the service on instantiation
+            else:
+                service_cls = type(service)
+                category = getattr(service, 'PLUGIN_CATEGORY', None)
+
+            index.add(path, (registry, name), service_cls, category, getattr(service, 'TAGS', ()))
+
+        return index
+
+    def query(self, cls=None, category=None, tag=None):
+        """Retrieve the services, of this registry and of its nested registries, matching all the criterias.
+
+        The services are retrieved from indexes, built on demand and dropped
+        when this registry or a nested registry is modified.
+
+        Args:
+          cls: class or base class of the services
+          category: ``PLUGIN_CATEGORY`` of the services
+          tag: capability declared by the services, in their ``TAGS`` attribute
+
+        Return:
+          dictionary of the dotted paths -> services
+        """
+        index = self.index
+        if index is None:
+            index = self.index = self.index_services()
+
+        return index.query(cls, category, tag)
 
     def get_service(self, service_path):
-        return functools.reduce(lambda d, name: d[name], service_path, self)
+        """Retrieve a service from the nested registries.
+
+        Args:
+          service_path: dotted path or sequence of the names of the nested registries then of the service
+
+        Return:
+          the service
+        """
+        path = service_path if isinstance(service_path, str) else '.'.join(service_path)
+
+        location = self.get_paths().get(path)
+        if location is None:
+            # Not indexed, i.e. path through a lazy service
+            return walk_service_path(self, path.split('.') if isinstance(service_path, str) else service_path)
+
+        registry, name = location
+        return registry[name]
 
     def find_services(self, criterias=lambda service: True):
         services = []
@@ -70,11 +1037,50 @@ class Services(plugins.Plugins):
 
         return services
 
+    def __getitem__(self, k):
+        service = self.plugins[k]
+        if type(service) is LazyService:
+            service = self._materialize(k, service)
+            if service is None:
+                raise KeyError(k)
+
+        return service
+
+    def get(self, k, v=None):
+        service = self.plugins.get(k, v)
+        if type(service) is LazyService:
+            service = self._materialize(k, service)
+            if service is None:
+                return v
+
+        return service
+
+    def freeze(self):
+        """Forbid the modifications of this registry and of its nested registries.
+
+        Return:
+          an immutable snapshot of this registry, with faster lookups
+        """
+        super(Services, self).freeze()
+
+        # This registry keeps its nested registries, the snapshot has their snapshots
+        services = ((k, v.freeze() if isinstance(v, plugins.Plugins) else v) for k, v in self.plugins.items())
+        return FrozenServices(services, self.postfix, self.plans, self.activated_by_default)
+
+    def values(self):
+        self.materialize()
+        return super(Services, self).values()
+
+    def items(self):
+        self.materialize()
+        return super(Services, self).items()
+
     def get_dependency(self, name, is_mandatory=True):
         """Retrieve a dependency from this registry.
 
         Args:
-          name: name of the dependency to retrieve (with the postfix)
+          name: name of the dependency to retrieve (with the postfix), ``<registry>__<service>`` for a service
+            of a nested registry
           is_mandatory: the dependency must be found
 
         Raises:
@@ -85,70 +1091,496 @@ class Services(plugins.Plugins):
           str, object: dependency found
         """
         name2 = name[: -len(self.postfix)]  # strip the postfix
+        found = True
 
         if name2 == 'services':
             dependency = self
+        elif name2 in self:
+            dependency = self.get(name2)
+        elif '__' in name2:  # ``<registry>__<service>`` is the path of a service in a nested registry
+            try:
+                dependency = self.get_service(name2.replace('__', '.'))
+            except (KeyError, TypeError):
+                found = False
         else:
-            if name2 not in self:
-                if is_mandatory:
-                    raise exceptions.MissingService(name)
-                else:
-                    name = None
+            found = False
 
-            dependency = self.get(name2)
+        if not found:
+            if is_mandatory:
+                raise exceptions.MissingService(name)
+
+            name = dependency = None
 
         return name, dependency
 
-    def __call__(self, f, *args, **kw):
-        """Call ``f`` with dependencies injection.
+    def create_injection_plan(self, f):
+        """Introspect a callable to find the dependencies to inject.
 
         Args:
           f: a callable
-          *args: arguments to pass to ``f``
-          **kw: keywords to pass to ``f``
 
         Return:
-          value returns by ``f``
+          tuple of ``(name, is_mandatory)`` of the parameters to inject
         """
         # Get the signature of ``f`` or the signature of its ``__init__`` method if ``f`` is a class
-        f2 = f
         if inspect.isclass(f):
-            f2 = f.__init__ if inspect.isroutine(f.__init__) else lambda: None
+            f = f.__init__ if inspect.isroutine(f.__init__) else lambda: None
 
         if PY_VERSION == 3:
-            # Retrieve the dependencies to inject
-            dependencies = dict(
-                self.get_dependency(p.name, p.default is EMPTY)
-                for p in signature(f2).parameters.values()
+            plan = tuple(
+                (p.name, p.default is EMPTY)
+                for p in signature(f).parameters.values()
                 if ((p.kind == POSITIONAL_OR_KEYWORD) or (p.kind == KEYWORD_ONLY)) and p.name.endswith(self.postfix)
             )
         else:
-            args_spec = getargspec(f2)
+            args_spec = getargspec(f)
 
             nb_default_values = len(args_spec.defaults or ())
             names = args_spec.args
 
-            # Retrieve the dependencies to inject
-            dependencies = dict(
-                self.get_dependency(name, i >= nb_default_values)
-                for i, name in enumerate(reversed(names))
-                if name.endswith(self.postfix)
+            plan = tuple(
+                (name, i >= nb_default_values) for i, name in enumerate(reversed(names)) if name.endswith(self.postfix)
             )
 
+        return plan
+
+    def get_injection_plan(self, f):
+        """Retrieve, from the cache, the dependencies to inject into a callable.
+
+        Args:
+          f: a callable
+
+        Return:
+          tuple of ``(name, is_mandatory)`` of the parameters to inject
+        """
+        return self.plans.get(f, self.create_injection_plan)
+
+    def get_dependencies(self, f):
+        """Resolve the dependencies to inject into a callable.
+
+        Args:
+          f: a callable
+
+        Raises:
+          exceptions.MissingDependency: a mandatory dependency is not found
+
+        Return:
+          dictionary of the dependencies found
+        """
+        dependencies = dict(
+            self.get_dependency(name, is_mandatory) for name, is_mandatory in self.get_injection_plan(f)
+        )
         dependencies.pop(None, None)
+
+        return dependencies
+
+    def __call__(self, f, *args, **kw):
+        """Call ``f`` with dependencies injection.
+
+        Args:
+          f: a callable
+          *args: arguments to pass to ``f``
+          **kw: keywords to pass to ``f``
+
+        Return:
+          value returns by ``f``
+        """
+        dependencies = self.current().get_dependencies(f)
         dependencies.update(kw)
 
         return f(*args, **dependencies)
 
-    def inject(self, f):
+    def compile_injector(self, f):
+        """Generate a specialised injection wrapper.
+
+        The wrapper has the signature of ``f``, the dependencies becoming
+        keyword-only parameters, and directly calls ``f`` with the resolved
+        dependencies, bound as constants. The registry generation and the
+        active scope are checked once per call. The dependencies are resolved
+        again when this registry is modified.
+
+        Args:
+          f: a callable
+
+        Return:
+          the generated wrapper or ``None`` if the signature of ``f`` can't be handled
+        """
+        f2 = f
+        if inspect.isclass(f):
+            f2 = f.__init__ if inspect.isroutine(f.__init__) else lambda: None
+
+        try:
+            parameters = list(signature(f2).parameters.values()) if PY_VERSION == 3 else None
+        except (ValueError, TypeError):
+            parameters = None
+
+        plan = self.get_injection_plan(f) if parameters else ()
+        if not plan:
+            return None
+
+        if f2 is not f:
+            parameters = parameters[1:]  # ``self`` parameter of ``__init__``
+
+        names = [name for name, _ in plan]
+        values = ['_v{}_'.format(i) for i in range(len(names))]
+        reserved = {'_f_', '_registry_', '_scope_', '_refresh_', '_inject_', '_generation_'}.union(values)
+        if any((p.name in reserved) or keyword.iskeyword(p.name) or not p.name.isidentifier() for p in parameters):
+            return None
+
+        # Generated source of the wrapper parameters and of the arguments passed to ``f``
+        signature_, arguments, positionals, keywords = [], [], [], []
+        defaults, kwdefaults = [], {}
+        positional_only = keyword_only = by_keyword = False
+        var_keyword = None
+
+        for p in parameters:
+            default = '' if p.default is EMPTY else '=None'
+
+            if p.name in names:
+                by_keyword = p.kind == POSITIONAL_OR_KEYWORD  # The next parameters can't be passed by position
+                continue
+
+            if p.kind == POSITIONAL_ONLY:
+                signature_.append(p.name + default)
+                arguments.append(p.name)
+                positionals.append(p.name)
+                positional_only = True
+            elif p.kind == POSITIONAL_OR_KEYWORD:
+                if positional_only:
+                    signature_.append('/')
+                    positional_only = False
+                signature_.append(p.name + default)
+                arguments.append(('{0}={0}' if by_keyword else '{0}').format(p.name))
+                positionals.append(p.name)
+            elif p.kind == VAR_POSITIONAL:
+                if by_keyword:
+                    return None
+
+                signature_.append('*' + p.name)
+                arguments.append('*' + p.name)
+                positionals.append('*' + p.name)
+                keyword_only = True
+            elif p.kind == KEYWORD_ONLY:
+                if not keyword_only:
+                    signature_.append('*')
+                    keyword_only = True
+                signature_.append(p.name + default)
+                arguments.append('{0}={0}'.format(p.name))
+                keywords.append("'{0}': {0}".format(p.name))
+            else:
+                var_keyword = p.name
+                continue
+
+            if p.default is not EMPTY:
+                if p.kind == KEYWORD_ONLY:
+                    kwdefaults[p.name] = p.default
+                else:
+                    defaults.append(p.default)
+
+        if positional_only:
+            signature_.append('/')
+        if not keyword_only:
+            signature_.append('*')
+        signature_.extend(name + '=_inject_' for name in names)
+        arguments.extend('{0}={1} if {0} is _inject_ else {0}'.format(*parameter) for parameter in zip(names, values))
+        if var_keyword:
+            signature_.append('**' + var_keyword)
+            arguments.append('**' + var_keyword)
+            keywords.append('**' + var_keyword)
+
+        source = INJECTOR_TEMPLATE.format(
+            values=', '.join(values),
+            parameters=', '.join(signature_),
+            arguments=', '.join(arguments),
+            positionals=''.join(positional + ', ' for positional in positionals),
+            keywords=', '.join(keywords),
+            injected=', '.join("'{0}': {0}".format(name) for name in names),
+        )
+        namespace = {}
+        exec(compile(source, '<injector of {}>'.format(getattr(f, '__qualname__', f)), 'exec'), namespace)  # noqa: S102
+
+        optional_defaults = {p.name: p.default for p in parameters if p.name in names}
+
+        def resolve():
+            generation = self.generation
+            dependencies = self.get_dependencies(f)
+
+            for name, value in zip(names, values):
+                cells[value].cell_contents = dependencies.get(name, optional_defaults.get(name))
+            cells['_generation_'].cell_contents = generation
+
+        def refresh(args, kw, injected):
+            kw.update((name, value) for name, value in injected.items() if value is not _INJECT)
+            if current_scope.get() is not None:
+                return self(f, *args, **kw)
+
+            resolve()
+
+            return injector(*args, **kw)
+
+        injector = namespace['create_injector'](f, self, current_scope.get, refresh, _INJECT, None, *values)
+        injector.__defaults__ = tuple(defaults) or None
+        injector.__kwdefaults__ = dict(kwdefaults, **dict.fromkeys(names, _INJECT))
+        cells = dict(zip(injector.__code__.co_freevars, injector.__closure__))
+
+        if not self.pending_services():  # Else resolved when ``f`` is called, not to instantiate the services
+            with contextlib.suppress(exceptions.MissingService):  # Raise the error when ``f`` is called
+                resolve()
+
+        return mark_coroutine_function(functools.update_wrapper(injector, f), f)
+
+    def inject(self, f=None, compile=False):
         """Decorate function to inject dependencies into.
 
-        Call ``f`` with dependencies injection
+        The dependencies are resolved when ``f`` is decorated, or on its first
+        call if some lazy services are still not instantiated, then only when
+        this registry is modified.
 
         Args:
           f: a callable
+          compile: generate a specialised wrapper for ``f``, for the hottest callables
 
         Return:
           the decorated ``f``
         """
-        return functools.update_wrapper(lambda *args, **kw: self(f, *args, **kw), f)
+        if f is None:
+            return functools.partial(self.inject, compile=compile)
+
+        injector = self.compile_injector(f) if compile else None
+        if injector is not None:
+            return injector
+
+        resolution = [(None, None)]  # (generation, dependencies)
+
+        def resolve():
+            generation = self.generation
+            try:
+                resolution[0] = (generation, self.get_dependencies(f))
+            except exceptions.MissingService:
+                # Raise the error when ``f`` is called
+                resolution[0] = (None, None)
+                raise
+
+            return resolution[0][1]
+
+        def injector(*args, **kw):
+            if current_scope.get() is not None:
+                return self(f, *args, **kw)
+
+            generation, dependencies = resolution[0]
+            if generation != self.generation:
+                dependencies = resolve()
+
+            return f(*args, **(dict(dependencies, **kw) if kw else dependencies))
+
+        if not self.pending_services():  # Else resolved when ``f`` is called, not to instantiate the services
+            with contextlib.suppress(exceptions.MissingService):  # Raise the error when ``f`` is called
+                resolve()
+
+        return mark_coroutine_function(functools.update_wrapper(injector, f), f)
+
+
+class FrozenServices(plugins.FrozenDict):
+    """Immutable snapshot of a services registry.
+
+    The lookups are the ones of a plain dictionary.
+    """
+
+    __slots__ = ('postfix', 'plans', 'activated_by_default', 'paths', 'index')
+    generation = 0  # Never modified
+
+    def __init__(self, services, postfix='_service', plans=None, activated_by_default=True):
+        super(FrozenServices, self).__init__(services)
+        self.postfix = postfix
+        self.plans = InjectionPlans(Services.PLANS_CACHE_SIZE) if plans is None else plans
+        self.activated_by_default = activated_by_default
+        self.paths = self.index_paths()
+
+        self.index = ServicesIndex()
+        for path, service in self.paths.items():
+            tags = getattr(service, 'TAGS', ())
+            self.index.add(path, service, type(service), getattr(service, 'PLUGIN_CATEGORY', None), tags)
+
+    def freeze(self):
+        return self
+
+    def query(self, cls=None, category=None, tag=None):
+        return self.index.query(cls, category, tag)
+
+    def index_paths(self):
+        """Index the services of this registry and of its nested registries by their dotted paths.
+
+        Return:
+          dictionary of the dotted paths -> service
+        """
+        paths = {}
+
+        to_index = [('', self)]
+        indexed = set()
+        while to_index:
+            prefix, registry = to_index.pop(0)
+            indexed.add(id(registry))
+
+            for name, service in registry.items():
+                paths[prefix + name] = service
+
+                nested = isinstance(service, (FrozenServices, plugins.Plugins))
+                if nested and (id(service) not in indexed):
+                    to_index.append((prefix + name + '.', service))
+
+        return paths
+
+    def get_service(self, service_path):
+        path = service_path if isinstance(service_path, str) else '.'.join(service_path)
+
+        try:
+            return self.paths[path]
+        except KeyError:
+            return walk_service_path(self, path.split('.') if isinstance(service_path, str) else service_path)
+
+    def pending_services(self):
+        return []  # The lazy services were instantiated when frozen
+
+    def copy(self, **kw):
+        """Create a modifiable copy of this registry.
+
+        Return:
+          the new registry
+        """
+        new = Services(self.activated_by_default, self.postfix[1:])
+        new.plans = self.plans
+        new.update(self)
+        new.update(kw)
+
+        return new
+
+    scope = Services.scope
+    current = Services.current
+    find_services = Services.find_services
+    get_dependency = Services.get_dependency
+    create_injection_plan = Services.create_injection_plan
+    get_injection_plan = Services.get_injection_plan
+    get_dependencies = Services.get_dependencies
+    __call__ = Services.__call__
+    compile_injector = Services.compile_injector
+    inject = Services.inject
+
+
+class ScopedServices(Services):
+    """Child registry.
+
+    The services are looked up in the child registry first then in its parent.
+    """
+
+    def __init__(self, parent, **services):
+        # Not calling ``Services.__init__()``: the generation is the one of the parent and the plans are shared
+        self.parent = parent
+        self.parents = (parent,) + getattr(parent, 'parents', ())
+        self.activated_by_default = parent.activated_by_default
+        self.postfix = parent.postfix
+        self.plans = parent.plans
+        self.plugins = services
+        self.local_generation = 0
+        self.tokens = []
+
+        self.containers = weakref.WeakSet()
+        self.paths = self.index = None
+        self.selection = OrderedDict()  # No services loaded in a child registry
+        self._dependency_graph = None
+
+    @property
+    def generation(self):
+        return self.parent.generation, self.local_generation
+
+    def changed(self, notified=None):
+        self.local_generation += 1
+        self.paths = self.index = None
+
+    def __enter__(self):
+        self.tokens.append(current_scope.set(self))
+        return self
+
+    def __exit__(self, *args):
+        current_scope.reset(self.tokens.pop())
+
+    def copy(self, **kw):
+        return self.parent.scope(**dict(self.plugins, **kw))
+
+    def freeze(self):
+        """Forbid the modifications of this child registry and of its parent.
+
+        Return:
+          an immutable snapshot of the parent registry overlaid with the services of this child registry
+        """
+        services = OrderedDict(self.parent.freeze())
+
+        if type(self.plugins) is not plugins.FrozenDict:
+            self.plugins = plugins.FrozenDict(self.plugins)
+            self.changed()
+
+        # The nested registries are frozen too
+        services.update((k, v.freeze() if isinstance(v, plugins.Plugins) else v) for k, v in self.plugins.items())
+
+        return FrozenServices(services, self.postfix, self.plans, self.activated_by_default)
+
+    def get_service(self, service_path):
+        path = service_path.split('.') if isinstance(service_path, str) else service_path
+        if path and (path[0] in self.plugins):
+            return walk_service_path(self, path)
+
+        return self.parent.get_service(service_path)
+
+    def query(self, cls=None, category=None, tag=None):
+        services = self.parent.query(cls, category, tag)
+        services = {path: service for path, service in services.items() if path.split('.')[0] not in self.plugins}
+
+        overlay = Services(self.activated_by_default, self.postfix[1:])
+        overlay.update(self.plugins)
+        services.update(overlay.query(cls, category, tag))
+
+        return services
+
+    def pending_services(self):
+        pending = super(ScopedServices, self).pending_services()
+        return [k for k in self.parent.pending_services() if k not in self.plugins] + pending
+
+    def __len__(self):
+        return len(self.parent) + sum(1 for k in self.plugins if k not in self.parent)
+
+    def __iter__(self):
+        for k in self.parent:
+            yield k
+
+        for k in self.plugins:
+            if k not in self.parent:
+                yield k
+
+    def __setitem__(self, k, v):
+        self.plugins[k] = v
+        self.changed()
+
+    def __getitem__(self, k):
+        return self.plugins[k] if k in self.plugins else self.parent[k]
+
+    def __contains__(self, k):
+        return (k in self.plugins) or (k in self.parent)
+
+    def __delitem__(self, k):
+        del self.plugins[k]
+        self.changed()
+
+    def get(self, k, v=None):
+        return self.plugins[k] if k in self.plugins else self.parent.get(k, v)
+
+    def update(self, d):
+        self.plugins.update(d)
+        self.changed()
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
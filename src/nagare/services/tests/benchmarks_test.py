@@ -0,0 +1,58 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import json
+
+from nagare.services import benchmarks
+
+
+def test_run():
+    results = benchmarks.run(['call.', 'get_service.'], number=10, repeat=2, nb_services=10)
+
+    assert set(results) == {
+        'call.class',
+        'call.keyword_only',
+        'call.optional',
+        'call.positional',
+        'get_service.dotted',
+        'get_service.nested',
+        'get_service.top',
+    }
+    assert all(result['best'] <= result['mean'] for result in results.values())
+
+
+def test_proxy():
+    results = benchmarks.run(['proxy.'], number=10, repeat=1)
+    assert set(results) == {'proxy.direct', 'proxy.wrapped', 'proxy.fast'}
+
+
+def test_compare():
+    baseline = {'a': {'best': 100.0, 'mean': 110.0}, 'b': {'best': 100.0, 'mean': 110.0}}
+    results = {'a': {'best': 110.0, 'mean': 120.0}, 'b': {'best': 130.0, 'mean': 140.0}, 'c': {'best': 1.0}}
+
+    assert benchmarks.compare(results, baseline) == [('b', 100.0, 130.0)]
+    assert benchmarks.compare(results, baseline, 0.05) == [('a', 100.0, 110.0), ('b', 100.0, 130.0)]
+
+
+def test_main(tmp_path):
+    output = str(tmp_path / 'results.json')
+
+    assert benchmarks.main(['-n', '10', '-r', '1', '-o', output, 'plugins.']) == 0
+    with open(output) as f:
+        results = json.load(f)
+
+    assert list(results['results']) == ['plugins.getitem']
+
+    results['results']['plugins.getitem']['best'] = 0.001
+    with open(output, 'w') as f:
+        json.dump(results, f)
+
+    assert benchmarks.main(['-n', '10', '-r', '1', '-b', output, 'plugins.']) == 1
@@ -0,0 +1,20 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+from nagare.services import plugin
+
+
+class DeferredService(plugin.Plugin):
+    LOAD_PRIORITY = 5
+
+    def __init__(self, name, dist, service2_service):
+        super(DeferredService, self).__init__(name, dist)
+        self.service2 = service2_service
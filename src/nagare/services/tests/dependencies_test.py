@@ -9,10 +9,16 @@
 # this distribution.
 # --
 
+import gc
+import time
+import asyncio
+import concurrent.futures
+
 import pytest
 
 from nagare.services.services import Services as Dependencies
-from nagare.services.exceptions import MissingService
+from nagare.services.services import FrozenServices
+from nagare.services.exceptions import FrozenRegistry, MissingService
 
 
 def test_dependencies_injection_to_lambdas():
@@ -47,25 +53,26 @@ def test_dependencies_injection_to_functions():
     assert dependencies(f3, 10, 22, c_service=2, d=10) == 44
 
 
-def test_dependencies_injection_with_decorator():
+@pytest.mark.parametrize('compile', [False, True])
+def test_dependencies_injection_with_decorator(compile):
     dependencies1 = Dependencies()
     dependencies1.update({'c': 42, 'other': 10})
     dependencies2 = Dependencies()
     dependencies2['c'] = 43
 
-    @dependencies1.inject
+    @dependencies1.inject(compile=compile)
     def f1(a, b, c):
         return a + b + c
 
     assert f1(10, 22, c=10) == 42
 
-    @dependencies1.inject
+    @dependencies1.inject(compile=compile)
     def f2(a, b, c_service):
         return a + b + c_service
 
     assert f2(10, 22) == 74
 
-    @dependencies2.inject
+    @dependencies2.inject(compile=compile)
     def f3(a, b, c_service, d):
         return a + b + c_service + d
 
@@ -125,3 +132,453 @@ def test_dependencies_injection_with_default_values():
 
     assert dependencies(lambda a, d_service=42: a + d_service, 10) == 52
     assert dependencies(lambda a, c_service=10, d_service=42: a + c_service + d_service, 10) == 94
+
+
+def test_injection_plans_cache():
+    dependencies = Dependencies()
+    dependencies['c'] = 42
+
+    def f(a, c_service, d_service=10):
+        return a + c_service + d_service
+
+    assert dependencies.get_injection_plan(f) == (('c_service', True), ('d_service', False))
+    assert (dependencies.plans.hits, dependencies.plans.misses) == (0, 1)
+
+    assert dependencies(f, 10) == 62
+    assert dependencies(f, 10, d_service=0) == 52
+    assert (dependencies.plans.hits, dependencies.plans.misses) == (2, 1)
+
+    class C(object):
+        def __init__(self, c_service):
+            self.value = c_service
+
+        def m(self, a, c_service):
+            return a + c_service
+
+    o = dependencies(C)
+    assert o.value == 42
+    assert dependencies(o.m, 10) == 52
+    assert dependencies(o.m, 20) == 62
+    assert (dependencies.plans.hits, dependencies.plans.misses) == (3, 3)
+
+    assert len(dependencies.plans) == 3
+    del f, C, o
+    gc.collect()
+    assert len(dependencies.plans) == 0
+
+
+def test_injection_plans_cache_eviction():
+    dependencies = Dependencies()
+    dependencies.plans.size = 2
+    dependencies['c'] = 42
+
+    def f1(c_service):
+        return c_service
+
+    def f2(c_service):
+        return c_service + 1
+
+    def f3(c_service):
+        return c_service + 2
+
+    assert dependencies(f1) == 42
+    assert dependencies(f2) == 43
+    assert dependencies(f1) == 42
+    assert dependencies(f3) == 44
+    assert len(dependencies.plans) == 2
+
+    dependencies(f1)
+    assert (dependencies.plans.hits, dependencies.plans.misses) == (2, 3)
+    dependencies(f2)
+    assert (dependencies.plans.hits, dependencies.plans.misses) == (2, 4)
+
+    assert dependencies(len, 'abc') == 3
+
+
+@pytest.mark.parametrize('compile', [False, True])
+def test_dependencies_injection_with_decorator_and_registry_changes(compile):
+    dependencies = Dependencies()
+
+    @dependencies.inject(compile=compile)
+    def f(a, c_service, d_service=10):
+        return a + c_service + d_service
+
+    with pytest.raises(MissingService, match='^c_service$'):
+        f(10)
+
+    dependencies['c'] = 42
+    assert f(10) == 62
+
+    dependencies.update({'d': 20})
+    assert f(10) == 72
+    assert f(10, d_service=0) == 52
+
+    generation = dependencies.generation
+    assert f(10) == 72
+    assert dependencies.generation == generation
+
+    del dependencies['d']
+    assert f(10) == 62
+
+    del dependencies['c']
+    with pytest.raises(MissingService, match='^c_service$'):
+        f(10)
+
+
+def test_compiled_injection_equivalence():
+    dependencies = Dependencies()
+    dependencies.update({'c': 42, 'other': 10})
+
+    class C(object):
+        def __init__(self, a, b, c_service, d=0):
+            self.value = a + b + c_service + d
+
+    cases = [
+        (lambda a, b, c: a + b + c, (10, 22), {'c': 10}),
+        (lambda a, b, c_service: a + b + c_service, (10, 22), {}),
+        (lambda a, b, c_service, d: a + b + c_service + d, (10, 22), {'d': 10}),
+        (lambda a, b, c_service, d: a + b + c_service + d, (10, 22), {'c_service': 2, 'd': 10}),
+        (lambda a, *, c_service, d=1: a + c_service + d, (10,), {}),
+        (lambda a, d_service=42: a + d_service, (10,), {}),
+        (lambda a, c_service=10, d_service=42: a + c_service + d_service, (10,), {}),
+        (lambda *args, c_service, **kw: (args, c_service, kw), (1, 2), {'x': 3}),
+        (lambda *args, c_service, **kw: (args, c_service, kw), (), {'c_service': 3, 'y': 4}),
+        (lambda a, b, other_service: a + b + other_service, (10, 22), {}),
+        (lambda a, c_service, b=1, *, d=2: a + c_service + b + d, (10,), {}),
+        (lambda a, c_service, b=1, *, d=2: a + c_service + b + d, (10,), {'b': 5, 'd': 0}),
+        (lambda a, c_service, b: a + c_service + b, (10,), {'b': 1}),
+        (lambda request, page=1, db_service=None: (request, page, db_service), ('req',), {}),
+        (lambda x=[], a_service=None: (x, a_service), (), {}),
+    ]
+
+    for f, args, kw in cases:
+        assert dependencies.inject(f, compile=True)(*args, **kw) == dependencies(f, *args, **kw)
+
+    injector = dependencies.compile_injector(C)
+    assert injector(10, 22).value == dependencies(C, 10, 22).value == 74
+    assert injector(10, 22, d=1).value == dependencies(C, 10, 22, d=1).value == 75
+
+    with pytest.raises(TypeError):
+        dependencies(lambda a, c_service: a + c_service, 10, 20)
+
+    with pytest.raises(TypeError):
+        dependencies.compile_injector(lambda a, c_service: a + c_service)(10, 20)
+
+    injector = dependencies.compile_injector(lambda a, e_service: a + e_service)
+    with pytest.raises(MissingService, match='^e_service$'):
+        injector(10)
+
+
+def test_compiled_injection_fallback():
+    dependencies = Dependencies()
+    dependencies['c'] = 42
+
+    assert dependencies.compile_injector(lambda a, b: a + b) is None
+    assert dependencies.compile_injector(len) is None
+    # The extra positional arguments would be passed as the dependency
+    assert dependencies.compile_injector(lambda a, c_service, *args: a) is None
+
+    f = dependencies.inject(lambda a, b: a + b, compile=True)
+    assert f(10, 32) == 42
+
+
+def test_scope():
+    dependencies = Dependencies()
+    dependencies.update({'c': 42, 'd': 10})
+
+    scope = dependencies.scope(d=20, e=30)
+    assert scope.plugins == {'d': 20, 'e': 30}
+    assert list(scope) == ['c', 'd', 'e']
+    assert len(scope) == 3
+    assert ('c' in scope) and ('e' in scope) and ('e' not in dependencies)
+    assert (scope['c'], scope['d'], scope.get('e'), scope.get('f', 0)) == (42, 20, 30, 0)
+    assert scope(lambda c_service, d_service, e_service: c_service + d_service + e_service) == 92
+    assert scope(lambda services_service: services_service) is scope
+
+    dependencies['c'] = 0
+    assert scope['c'] == 0
+
+    nested = scope.scope(c=1)
+    assert nested(lambda c_service, d_service, e_service: c_service + d_service + e_service) == 51
+
+
+def test_scope_registry():
+    closed = []
+
+    class Service(object):
+        def __init__(self, name):
+            self.name = name
+
+        def close(self):
+            closed.append(self.name)
+
+    dependencies = Dependencies()
+    dependencies.update({'c': Service('c'), 'nested': Dependencies()})
+    scope = dependencies.scope(d=Service('d'))
+
+    assert len(scope.dependency_graph) == 0
+    assert scope.query(cls=Service) == {'c': dependencies['c'], 'd': scope['d']}
+
+    generation = scope.generation
+    scope['e'] = Service('e')
+    assert scope.generation != generation
+    assert scope.query(cls=Service) == {'c': dependencies['c'], 'd': scope['d'], 'e': scope['e']}
+
+    # Only the services of the child registry are closed
+    report = scope.shutdown()
+    assert sorted(report) == ['d', 'e']
+    assert sorted(closed) == ['d', 'e']
+
+    frozen = scope.freeze()
+    assert type(frozen) is FrozenServices
+    assert list(frozen) == ['c', 'nested', 'd', 'e']
+    assert type(frozen['nested']) is FrozenServices
+    assert list(scope.plugins) == ['d', 'e']
+    assert scope.freeze() == frozen
+
+    for registry in (scope, dependencies):
+        with pytest.raises(FrozenRegistry):
+            registry['f'] = 1
+
+
+@pytest.mark.parametrize('compile', [False, True])
+def test_scope_activation(compile):
+    dependencies = Dependencies()
+    dependencies.update({'c': 42, 'd': 10})
+    other = Dependencies()
+    other['c'] = 0
+
+    @dependencies.inject(compile=compile)
+    def f(c_service, d_service, e_service=0):
+        return c_service + d_service + e_service
+
+    assert f() == 52
+    assert dependencies(f) == 52
+
+    with dependencies.scope(d=20, e=30) as scope:
+        assert f() == 92
+        assert f(e_service=0) == 62
+        assert dependencies(f) == 92
+        assert other(lambda c_service: c_service) == 0
+
+        scope['e'] = 40
+        assert f() == 102
+
+        with scope.scope(c=1):
+            assert f() == 61
+
+        assert f() == 102
+
+    assert f() == 52
+
+    with other.scope(d=0):
+        assert f() == 52
+
+
+def test_scope_activation_in_threads_and_tasks():
+    dependencies = Dependencies()
+    dependencies['c'] = 0
+
+    @dependencies.inject
+    def f(c_service):
+        return c_service
+
+    def request(i):
+        with dependencies.scope(c=i):
+            time.sleep(0.01)
+            return f()
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(request, range(8))) == list(range(8))
+
+    async def async_request(i):
+        with dependencies.scope(c=i):
+            await asyncio.sleep(0.01)
+            return f()
+
+    async def requests():
+        return await asyncio.gather(*map(async_request, range(8)))
+
+    assert asyncio.run(requests()) == list(range(8))
+    assert f() == 0
+
+
+@pytest.mark.parametrize('compile', [False, True])
+def test_dependencies_injection_to_coroutines(compile):
+    dependencies = Dependencies()
+    dependencies['c'] = 42
+
+    async def f(a, c_service):
+        await asyncio.sleep(0)
+        return a + c_service
+
+    async def g(n, c_service):
+        for i in range(n):
+            yield i + c_service
+
+    f2 = dependencies.inject(f, compile=compile)
+    assert asyncio.iscoroutinefunction(f2)
+    assert asyncio.run(f2(10)) == 52
+    assert asyncio.run(dependencies(f, 10)) == 52
+
+    async def consume(g):
+        return [i async for i in g]
+
+    g2 = dependencies.inject(g, compile=compile)
+    assert asyncio.run(consume(g2(2))) == [42, 43]
+    assert asyncio.run(consume(dependencies(g, 2))) == [42, 43]
+
+
+@pytest.mark.parametrize('compile', [False, True])
+def test_freeze(compile):
+    dependencies = Dependencies()
+    dependencies.update({'c': 42, 'nested': Dependencies()})
+    dependencies['nested']['d'] = 10
+
+    frozen = dependencies.freeze()
+    assert type(frozen) is FrozenServices
+    assert type(frozen['nested']) is FrozenServices
+    assert frozen == {'c': 42, 'nested': {'d': 10}}
+    assert frozen.get_service(('nested', 'd')) == 10
+
+    # The original registry keeps its nested registries and stays queryable
+    assert type(dependencies['nested']) is Dependencies
+    assert sorted(dependencies.query()) == ['c', 'nested', 'nested.d']
+    assert dependencies.get_service('nested.d') == 10
+
+    for registry in (dependencies, dependencies['nested'], frozen, frozen['nested']):
+        with pytest.raises(FrozenRegistry):
+            registry['e'] = 1
+
+        with pytest.raises(FrozenRegistry):
+            registry.update({'e': 1})
+
+    with pytest.raises(FrozenRegistry):
+        del frozen['c']
+
+    @frozen.inject(compile=compile)
+    def f(a, c_service, nested_service):
+        return a + c_service + nested_service['d']
+
+    assert f(1) == 53
+    assert frozen(lambda a, c_service: a + c_service, 1) == 43
+
+    with frozen.scope(c=0):
+        assert f(1) == 11
+
+    new = frozen.copy(e=1)
+    new['f'] = 2
+    assert sorted(new.keys()) == ['c', 'e', 'f', 'nested']
+
+
+def test_freeze_nested_registries(monkeypatch):
+    dependencies = registry = Dependencies()
+    for i in range(10):
+        registry['nested'] = registry = Dependencies()
+        registry['value'] = i
+
+    snapshots = []
+    init = FrozenServices.__init__
+
+    def create_snapshot(self, *args, **kw):
+        snapshots.append(self)
+        init(self, *args, **kw)
+
+    monkeypatch.setattr(FrozenServices, '__init__', create_snapshot)
+
+    # Each registry is snapshotted once
+    frozen = dependencies.freeze()
+    assert len(snapshots) == 11
+    assert frozen.get_service('nested.' * 10 + 'value') == 9
+
+
+def test_service_paths():
+    dependencies = Dependencies()
+    dependencies.update({'c': 42, 'database': Dependencies()})
+    dependencies['database']['session'] = 'session1'
+
+    assert dependencies.get_service('c') == 42
+    assert dependencies.get_service('database.session') == 'session1'
+    assert dependencies.get_service(('database', 'session')) == 'session1'
+
+    with pytest.raises(KeyError):
+        dependencies.get_service('database.engine')
+
+    generation = dependencies.generation
+    dependencies['database']['session'] = 'session2'
+    dependencies['database']['engine'] = 'engine'
+    assert dependencies.generation == generation + 2
+    assert dependencies.get_service('database.session') == 'session2'
+    assert dependencies.get_service('database.engine') == 'engine'
+
+    dependencies['database'] = Dependencies()
+    dependencies['database']['session'] = 'session3'
+    assert dependencies.get_service('database.session') == 'session3'
+
+    with dependencies.scope(database={'session': 'session4'}) as scope:
+        assert scope.get_service('database.session') == 'session4'
+        assert scope.get_service('c') == 42
+
+    frozen = dependencies.freeze()
+    assert frozen.get_service('database.session') == 'session3'
+    assert frozen.get_service(['database', 'session']) == 'session3'
+
+
+@pytest.mark.parametrize('compile', [False, True])
+def test_nested_dependencies_injection(compile):
+    dependencies = Dependencies()
+    dependencies['database'] = Dependencies()
+    dependencies['database']['session'] = 'session1'
+
+    @dependencies.inject(compile=compile)
+    def f(database__session_service, database__engine_service=None):
+        return database__session_service, database__engine_service
+
+    assert f() == ('session1', None)
+
+    dependencies['database']['engine'] = 'engine'
+    assert f() == ('session1', 'engine')
+
+    assert dependencies(f) == ('session1', 'engine')
+
+    with pytest.raises(MissingService):
+        dependencies(lambda database__connection_service: None)
+
+
+class HealthCheck(object):
+    TAGS = ('health_check',)
+    PLUGIN_CATEGORY = 'nagare.services'
+
+
+class Database(HealthCheck):
+    pass
+
+
+class Cache(HealthCheck):
+    PLUGIN_CATEGORY = 'nagare.caches'
+
+
+def test_query():
+    database = Database()
+    cache = Cache()
+
+    dependencies = Dependencies()
+    dependencies.update({'c': 42, 'database': database, 'nested': Dependencies()})
+    dependencies['nested']['cache'] = cache
+
+    assert dependencies.query(tag='health_check') == {'database': database, 'nested.cache': cache}
+    assert dependencies.query(cls=Database) == {'database': database}
+    assert dependencies.query(cls=HealthCheck, category='nagare.caches') == {'nested.cache': cache}
+    assert dependencies.query(cls=int) == {'c': 42}
+    assert dependencies.query(tag='unknown') == {}
+    assert len(dependencies.query()) == 4
+
+    dependencies['nested']['database'] = database2 = Database()
+    del dependencies['database']
+    assert dependencies.query(cls=Database) == {'nested.database': database2}
+
+    with dependencies.scope(nested=Dependencies(), database=database) as scope:
+        assert scope.query(tag='health_check') == {'database': database}
+
+    frozen = dependencies.freeze()
+    assert frozen.query(tag='health_check') == {'nested.cache': cache, 'nested.database': database2}
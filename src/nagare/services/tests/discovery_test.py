@@ -0,0 +1,108 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import os
+import sys
+import json
+
+from nagare.services import discovery
+
+
+def test_fingerprint(tmp_path):
+    paths = [str(tmp_path), str(tmp_path / 'not_existing')]
+
+    signature = discovery.fingerprint(paths)
+    assert discovery.fingerprint(paths) == signature
+
+    (tmp_path / 'test.txt').write_text('')
+    assert discovery.fingerprint(paths) != signature
+
+    signature = discovery.fingerprint(paths)
+    (tmp_path / 'test-1.0.dist-info').mkdir()
+    assert discovery.fingerprint(paths) != signature
+
+    signature = discovery.fingerprint(paths)
+    os.utime(tmp_path / 'test-1.0.dist-info', ns=(0, 0))
+    assert discovery.fingerprint(paths) != signature
+
+
+def names(entry_points):
+    return {
+        group: [(dist.metadata['name'], name) for dist, name, _ in entries] for group, entries in entry_points.items()
+    }
+
+
+def test_cache(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / 'cache.json')
+    groups = discovery.scan_entry_points()
+
+    assert discovery.load_index(cache_file).entry_points.keys() == groups.keys()
+    with open(cache_file) as f:
+        cache = json.load(f)
+
+    assert cache['fingerprint'] == discovery.fingerprint()
+    assert set(cache['groups']) == set(groups)
+
+    def scan_entry_points():
+        raise AssertionError('cache not used')
+
+    with monkeypatch.context() as m:
+        m.setattr(discovery, 'scan_entry_points', scan_entry_points)
+
+        index = discovery.load_index(cache_file)
+        assert index.entry_points == {}
+        assert names({group: index.get_entry_points(group) for group in groups}) == names(groups)
+
+    site = tmp_path / 'site'
+    site.mkdir()
+    monkeypatch.setattr(sys, 'path', sys.path + [str(site)])
+    signature = cache['fingerprint']
+    (site / 'test-1.0.dist-info').mkdir()
+
+    discovery.load_index(cache_file)
+    with open(cache_file) as f:
+        cache = json.load(f)
+
+    assert cache['fingerprint'] != signature
+    assert cache['fingerprint'] == discovery.fingerprint()
+
+
+def test_invalid_cache(tmp_path):
+    cache_file = tmp_path / 'cache.json'
+    cache_file.write_text('invalid')
+
+    index = discovery.load_index(str(cache_file))
+    assert index.entry_points.keys() == discovery.scan_entry_points().keys()
+    assert json.loads(cache_file.read_text())['version'] == discovery.CACHE_VERSION
+
+
+def test_index(monkeypatch):
+    discovery.invalidate()
+    index = discovery.get_index()
+    assert discovery.get_index() is index
+
+    calls = []
+    monkeypatch.setattr(discovery, 'scan_entry_points', lambda: calls.append(1) or {})
+    assert discovery.get_entry_points('console_scripts') == index.get_entry_points('console_scripts')
+    assert not calls
+
+    entry_points = index.get_entry_points('console_scripts')
+    by_name = discovery.get_entry_points_by_name('console_scripts')
+    assert set(by_name) == {name for _, name, _ in entry_points}
+    assert discovery.get_entry_points_by_name('console_scripts') is by_name
+    assert discovery.get_entry_points('nagare.not_existing') == []
+
+    discovery.invalidate()
+    assert discovery.get_entry_points('console_scripts') == []
+    assert calls == [1]
+
+    monkeypatch.undo()
+    discovery.invalidate()
@@ -0,0 +1,102 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import io
+import json
+
+import pytest
+
+from nagare.services.graph import DependencyGraph
+from nagare.services.exceptions import BadConfiguration
+
+
+def create_graph():
+    return DependencyGraph(
+        [
+            ('database', {}),
+            ('cache', {'redis': True}),
+            ('session', {'database': True, 'cache': False}),
+            ('app', {'session': True, 'database': True}),
+            ('logging', {}),
+        ]
+    )
+
+
+def test_dependencies():
+    graph = create_graph()
+
+    assert graph.dependencies('cache') == {}
+    assert graph.dependencies('session') == {'database': True, 'cache': False}
+    assert graph.dependents('database') == ['session', 'app']
+    assert graph.dependents('app') == []
+    assert graph.all_dependents(['cache']) == {'session', 'app'}
+    assert graph.all_dependents(['database', 'session']) == {'app'}
+
+
+def test_order():
+    graph = create_graph()
+
+    assert graph.find_cycle() is None
+    assert graph.topological_order() == ['database', 'cache', 'logging', 'session', 'app']
+    assert graph.topological_order(reverse=True) == ['app', 'session', 'logging', 'cache', 'database']
+
+    assert graph.check_order(['database', 'cache', 'session', 'app', 'logging']) == []
+    assert graph.check_order(['session', 'database', 'app', 'cache']) == [
+        ('session', 'database', True),
+        ('session', 'cache', False),
+    ]
+
+
+def test_cycle():
+    graph = create_graph()
+    graph.add('database', {'app': True})
+
+    assert graph.find_cycle() == ['database', 'app', 'session', 'database']
+
+    with pytest.raises(BadConfiguration, match='circular dependencies'):
+        graph.topological_order()
+
+
+def test_critical_path():
+    graph = create_graph()
+    durations = {'database': 0.1, 'cache': 0.3, 'session': 0.05, 'app': 0.01, 'logging': 0.2}
+
+    duration, path = graph.critical_path(durations)
+    assert duration == pytest.approx(0.36)
+    assert path == ['cache', 'session', 'app']
+
+    assert graph.critical_path({'logging': 1})[1] == ['logging']
+    assert DependencyGraph().critical_path({}) == (0, [])
+
+
+def test_export():
+    graph = create_graph()
+    durations = {'database': 0.1, 'cache': 0.3, 'session': 0.05, 'app': 0.01}
+
+    exported = graph.to_dict(durations)
+    assert exported['services'][1] == {'name': 'cache', 'duration': 0.3, 'critical': True}
+    assert exported['services'][4] == {'name': 'logging', 'duration': None, 'critical': False}
+    assert {'service': 'session', 'dependency': 'cache', 'mandatory': False} in exported['dependencies']
+    assert exported['critical_path']['services'] == ['cache', 'session', 'app']
+
+    f = io.StringIO()
+    graph.dump(f, 'json', durations)
+    assert json.loads(f.getvalue()) == exported
+
+    dot = graph.to_dot(durations)
+    assert dot.startswith('digraph services {')
+    assert '"cache" [label="cache\\n300.00 ms", color=red, penwidth=2];' in dot
+    assert '"logging" [label="logging"];' in dot
+    assert '"session" -> "cache" [style=dashed, color=red, penwidth=2];' in dot
+    assert '"session" -> "database";' in dot
+
+    with pytest.raises(ValueError, match='invalid graph format'):
+        graph.dump(f, 'svg')
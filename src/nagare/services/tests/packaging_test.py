@@ -0,0 +1,38 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+from importlib import metadata
+
+from nagare import packaging
+
+
+def test_memoised_location(monkeypatch):
+    packaging.clear_cache()
+
+    names = []
+    read_editable_project_location = packaging.read_editable_project_location
+    monkeypatch.setattr(
+        packaging,
+        'read_editable_project_location',
+        lambda name: names.append(name) or read_editable_project_location(name),
+    )
+
+    dist = metadata.distribution('pytest')
+    location = str(dist.locate_file(''))
+
+    assert packaging.get_location(dist) == location
+    assert packaging.get_location(metadata.distribution('pytest')) == location
+    assert packaging.Distribution(metadata.distribution('pytest')).editable_project_location is None
+    assert names == ['pytest']
+
+    packaging.clear_cache()
+    assert packaging.get_location(metadata.distribution('pytest')) == location
+    assert names == ['pytest', 'pytest']
@@ -10,6 +10,7 @@
 # --
 
 import os
+import time
 import pathlib
 from importlib import metadata
 
@@ -209,3 +210,99 @@ def test_load3():
     assert users.name == 'user'
     assert users.dist.metadata['name'] == 'nagare-services'
     assert users.default_user == 'John Doe <admin@localhost>'
+
+
+def test_activation():
+    entries = [(None, 'test1', 1), (None, 'test2', 2), (None, 'test3', 3), (None, 'test1', 4)]
+    config = {'test1': {'activated': '$flag'}, 'test2': {'activated': 'on'}}
+
+    activated = plugins.Plugins.filter_activated_entry_points(entries, config, {'flag': 'off'}, True)
+    assert isinstance(activated, plugins.ActivatedEntries)
+    assert activated == [(None, 'test2', 2), (None, 'test3', 3)]
+
+    activated = plugins.Plugins.filter_activated_entry_points(entries, config, {'flag': 'on'}, False)
+    assert activated == [(None, 'test1', 1), (None, 'test2', 2), (None, 'test1', 4)]
+
+    assert plugins.Plugins.filter_activated_entry_points([], config, {}, True) == []
+
+
+def test_compiled_spec():
+    spec1 = plugins.compile_spec({'test1': dict(DummyPlugin1.CONFIG_SPEC), 'test2': dict(DummyPlugin2.CONFIG_SPEC)})
+    spec2 = plugins.compile_spec({'test1': dict(DummyPlugin1.CONFIG_SPEC), 'test2': dict(DummyPlugin2.CONFIG_SPEC)})
+    spec3 = plugins.compile_spec({'test1': dict(DummyPlugin1.CONFIG_SPEC)})
+
+    assert spec1 is spec2
+    assert spec1 is not spec3
+
+    repository = DummyPlugins()
+    repository.load_plugins(None, CONFIG['my_plugins'], {'root': '/tmp/test', 'greeting': 'Hello'}, True)
+    hits = plugins._compile_spec.cache_info().hits
+
+    repository = DummyPlugins()
+    repository.load_plugins(None, CONFIG['my_plugins'], {'root': '/tmp/test', 'greeting': 'Hello'}, True)
+    assert plugins._compile_spec.cache_info().hits == hits + 1
+
+    (_, plugin1), (_, plugin2) = repository.items()
+    assert plugin1.plugin_config == {'activated': True, 'value1': 20, 'value2': '/tmp/test/a.txt'}
+    assert plugin2.plugin_config['value1'] == 10
+
+
+def test_profile():
+    class Plugins(DummyPlugins):
+        ENTRY_POINTS = 'nagare.plugins.test3'
+
+    repository = Plugins()
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'plugins.cfg'))
+    repository.load_plugins(None, config['my_plugins2'], {'default_email': 'admin@localhost'}, validate=True)
+
+    profile = repository.profile
+    assert profile.entry_points == 'nagare.plugins.test3'
+    assert list(profile.plugins) == ['authentication']
+
+    authentication = profile.plugins['authentication']
+    assert authentication.dist.metadata['name'] == 'nagare-services'
+    assert authentication.instantiation > 0
+    assert authentication.children is repository['authentication'].profile
+    assert set(authentication.children.plugins) == {'ldap', 'user'}
+    assert authentication.instantiation >= authentication.children.total
+
+    profile = profile.to_dict()
+    assert profile['plugins'][0]['name'] == 'authentication'
+    assert {plugin['name'] for plugin in profile['plugins'][0]['children']['plugins']} == {'ldap', 'user'}
+
+
+class SlowEntryPoint(object):
+    """Entry point whose first loading takes 0.1 s, like the import of a module."""
+
+    def __init__(self, name, plugin):
+        self.name = name
+        self.value = 'nagare.services.tests.plugins_test:' + plugin.__name__
+        self.plugin = plugin
+        self.loaded = False
+
+    def load(self):
+        if not self.loaded:
+            time.sleep(0.1)
+            self.loaded = True
+
+        return self.plugin
+
+
+def test_profile_total():
+    class Plugins(DummyPlugins):
+        @classmethod
+        def iter_entry_points(cls, name, entry_points, config):
+            dist = metadata.PathDistribution(pathlib.Path(__file__).parent)
+            return [(dist, 'test1', SlowEntryPoint('test1', DummyPlugin1))]
+
+    repository = Plugins()
+
+    start = time.perf_counter()
+    repository.load_plugins(None, CONFIG['my_plugins'], {'root': '/tmp/test', 'greeting': 'Hello'}, True)
+    duration = time.perf_counter() - start
+
+    # The import triggered by the validation is recorded once, as import
+    profile = repository.profile
+    assert profile.plugins['test1'].import_time >= 0.1
+    assert profile.validation < 0.1
+    assert profile.total <= duration
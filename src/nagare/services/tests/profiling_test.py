@@ -0,0 +1,97 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import io
+import json
+import time
+
+from nagare.services import profiling
+
+
+def test_measure():
+    profile = profiling.LoadingProfile('test', 'nagare.plugins.test')
+
+    with profiling.measure('discovery', profile=profile):
+        time.sleep(0.01)
+
+    with profiling.measure('import', 'plugin1', profile):
+        pass
+
+    with profiling.measure('instantiation', 'plugin1', profile):
+        time.sleep(0.01)
+
+    assert profile.discovery >= 0.01
+    assert profile.activation == 0
+    assert list(profile.plugins) == ['plugin1']
+    assert profile.plugins['plugin1'].instantiation >= 0.01
+    assert profile.total == profile.discovery + profile.plugins['plugin1'].total
+
+
+def test_no_active_profile():
+    with profiling.measure('import', 'plugin1'):
+        pass
+
+    assert profiling.current_profile.get() is None
+
+
+def test_nested_profiles():
+    profile = profiling.LoadingProfile('test')
+
+    with profile.activate():
+        with profiling.measure('import', 'plugin1'):
+            pass
+
+    with profiling.measure('instantiation', 'plugin1', profile):
+        child = profiling.LoadingProfile('plugin1')
+        with child.activate():
+            with profiling.measure('validation'):
+                time.sleep(0.01)
+
+        assert profiling.current_plugin.get() is profile.plugins['plugin1']
+
+    assert profiling.current_plugin.get() is None
+    assert profile.plugins['plugin1'].children is child
+    assert profile.plugins['plugin1'].instantiation >= child.total
+
+
+def test_nested_measures():
+    profile = profiling.LoadingProfile('test')
+
+    with profile.activate():
+        with profiling.measure('validation'):
+            time.sleep(0.01)
+            with profiling.measure('import', 'plugin1'):
+                time.sleep(0.02)
+
+    assert 0.01 <= profile.validation < 0.02
+    assert profile.plugins['plugin1'].import_time >= 0.02
+
+
+def test_sorted_output():
+    profile = profiling.LoadingProfile('test')
+    profile.add('instantiation', 0.001, 'fast')
+    profile.add('instantiation', 0.003, 'slow')
+    profile.add('import', 0.002, 'medium')
+
+    assert [plugin.name for plugin in profile.sorted_plugins()] == ['slow', 'medium', 'fast']
+
+    f = io.StringIO()
+    profile.dump(f)
+    dump = json.loads(f.getvalue())
+    assert [plugin['name'] for plugin in dump['plugins']] == ['slow', 'medium', 'fast']
+    assert dump['plugins'][0]['instantiation'] == 0.003
+    assert dump['plugins'][0]['children'] is None
+
+    lines = []
+    profile.report(display=lines.append)
+    names = [line.split()[0] for line in lines[4:]]
+    assert names == ['slow', 'medium', 'fast']
+    assert lines[4].split()[1:4] == ['0.00', '3.00', '3.00']
@@ -0,0 +1,98 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import pytest
+
+from nagare.services.proxy import BoundMethod, proxy_to
+
+
+class Target(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, increment=0):
+        return self.value + increment
+
+    def set(self, value):
+        self.value = value
+
+    def _private(self):
+        return 'private'
+
+    def excluded(self):
+        return 'target'
+
+
+@pytest.mark.parametrize('fast', [False, True])
+def test_proxy(fast):
+    @proxy_to(Target, blacklist=('excluded',), fast=fast)
+    class Proxy(object):
+        def __init__(self, target):
+            self.proxy_target = target
+
+        def excluded(self):
+            return 'proxy'
+
+    proxy = Proxy(Target(42))
+    assert proxy.get() == 42
+    assert proxy.get(increment=1) == 43
+
+    proxy.set(10)
+    assert proxy.proxy_target.value == 10
+    assert proxy.get() == 10
+
+    assert proxy.excluded() == 'proxy'
+
+    with pytest.raises(AttributeError):
+        proxy._private
+
+    with pytest.raises(AttributeError):
+        proxy.unknown
+
+
+def test_fast_proxy():
+    @proxy_to(Target, fast=True)
+    class Proxy(object):
+        def __init__(self, target):
+            self.proxy_target = target
+
+        def get(self, increment=0):
+            return 'proxy'
+
+    # No ``__getattr__`` slowing down all the attribute lookups
+    assert '__getattr__' not in vars(Proxy)
+    assert type(vars(Proxy)['set']) is BoundMethod
+
+    target = Target(42)
+    proxy = Proxy(target)
+
+    method = proxy.set
+    assert method.__self__ is target
+    assert vars(proxy)['set'] is method
+    assert proxy.set is method
+
+    # The methods defined by the proxy class are still delegated to the target
+    assert proxy.get() == 42
+    assert 'get' not in vars(proxy)
+
+
+def test_fast_proxy_getattr():
+    @proxy_to(Target, fast=True)
+    class Proxy(object):
+        def __init__(self, target):
+            self.proxy_target = target
+
+        def __getattr__(self, name):
+            return name.upper()
+
+    proxy = Proxy(Target(42))
+    assert proxy.get() == 42
+    assert proxy.unknown == 'UNKNOWN'
@@ -0,0 +1,89 @@
+# Encoding: utf-8
+
+# --
+# Copyright (c) 2008-2024 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import json
+
+import pytest
+
+from nagare.services.reporters import Reporter
+
+ROWS = [('b', 5), ('a', 10), ('c, d', 7)]
+
+
+def create_reporter(calls):
+    def extract(column, f):
+        def _(*args):
+            calls.append(column)
+            return f(*args)
+
+        return _
+
+    return Reporter(
+        (
+            ('Name', extract('name', lambda name, value: name), True),
+            ('Value', extract('value', lambda name, value: str(value)), False),
+        )
+    )
+
+
+def test_single_extraction():
+    calls = []
+    lines = []
+    create_reporter(calls).report({'name', 'value'}, ROWS, False, lines.append)
+
+    assert len(calls) == 2 * len(ROWS)
+    assert lines == ['Name Value', '---- -----', 'b        5', 'a       10', 'c, d     7']
+
+
+def test_text():
+    lines = []
+    create_reporter([]).report({'name'}, ROWS, True, lines.append, indent=2)
+    assert lines == ['  Name', '  ----', '  a   ', '  b   ', '  c, d']
+
+    lines = []
+    create_reporter([]).report({'value'}, ROWS, True, lines.append)
+    assert lines == ['Value', '-----', '    5', '    7', '   10']
+
+    lines = []
+    create_reporter([]).report({'name'}, [], True, lines.append)
+    assert lines == ['  <empty>']
+
+
+def test_stream():
+    def rows():
+        yield 'b', 5
+        assert lines == ['Name\tValue', 'b\t5']
+        yield 'a', 10
+
+    lines = []
+    create_reporter([]).report({'name', 'value'}, rows(), False, lines.append, format='stream')
+    assert lines == ['Name\tValue', 'b\t5', 'a\t10']
+
+
+def test_csv():
+    lines = []
+    create_reporter([]).report({'name', 'value'}, ROWS, False, lines.append, format='csv')
+    assert lines == ['Name,Value', 'b,5', 'a,10', '"c, d",7']
+
+
+def test_json():
+    lines = []
+    create_reporter([]).report({'name', 'value'}, ROWS, True, lines.append, format='json')
+    assert json.loads(''.join(lines)) == [
+        {'Name': 'a', 'Value': '10'},
+        {'Name': 'b', 'Value': '5'},
+        {'Name': 'c, d', 'Value': '7'},
+    ]
+
+
+def test_invalid_format():
+    with pytest.raises(ValueError):
+        create_reporter([]).report({'name'}, ROWS, False, format='xml')
@@ -9,8 +9,18 @@
 # this distribution.
 # --
 
+import gc
+import io
 import os
+import sys
+import json
+import time
+import logging
+import asyncio
 import pathlib
+import threading
+import statistics
+import subprocess
 from importlib import metadata
 
 import pytest
@@ -76,6 +86,38 @@ class DummyService6(plugin.Plugin):
         raise NotImplementedError()
 
 
+class DummyService7(DummyService3):
+    LOAD_PRIORITY = 10
+
+
+class DummyService8(DummyService3):
+    LOAD_PRIORITY = 2
+
+    def __init__(self, name, dist, value1, value2, service1_service=None):
+        super(DummyService8, self).__init__(name, dist, value1, value2)
+        self.service1 = service1_service
+
+
+class AsyncService(plugin.Plugin):
+    LOAD_PRIORITY = 2
+
+    async def async_start(self, service1_service):
+        await asyncio.sleep(0)
+        self.service1 = service1_service
+
+
+async def create_async_service(name, dist, service2_service):
+    await asyncio.sleep(0)
+
+    service = DummyService5(name, dist)
+    service.service2 = service2_service
+
+    return service
+
+
+create_async_service.LOAD_PRIORITY = 3
+create_async_service.CONFIG_SPEC = plugin.Plugin.CONFIG_SPEC
+
 # ---------------------------------------------------------------------------------------------------------------------
 
 
@@ -175,3 +217,616 @@ def test_injection():
 
     with pytest.raises(exceptions.MissingService, match='service2_service'):
         services(lambda x, y, service2_service: (x, y, service2_service), 42, y='hello')
+
+
+def test_async_load():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test5'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+    services = asyncio.run(Services().async_load_services(None, config['async'], {'root': '/tmp/test'}, True))
+
+    assert list(services) == ['service1', 'service2', 'service3']
+
+    service1, service2, service3 = services.values()
+    assert service1.value2 == '/tmp/test/a.txt'
+    assert isinstance(service2, AsyncService)
+    assert service2.service1 is service1
+    assert isinstance(service3, DummyService5)
+    assert service3.name == 'service3'
+    assert service3.service2 is service2
+
+
+def test_concurrent_load():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test3'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+    services = Services().load_services(None, config['activation1'], {'root': '/tmp/test'}, True, max_workers=4)
+
+    assert list(services) == ['service1', 'service3']
+
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test2'
+
+    services = Services().load_services(None, config['services'], {'root': '/tmp/test'}, True, max_workers=4)
+
+    assert list(services) == ['service1', 'service2']
+    assert services['service2'].service1 is services['service1']
+
+
+def test_concurrent_load_priority_inversion():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test6'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+
+    with pytest.raises(exceptions.BadConfiguration, match="'service2' is loaded before its dependency 'service1'"):
+        Services().load_services(None, config['services'], {'root': '/tmp/test'}, True, max_workers=4)
+
+
+def test_dependency_graph():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test2'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+    services = Services().load_services(None, config['services'], {'root': '/tmp/test'}, True)
+
+    assert services.dependency_graph.nodes == {'service1': {}, 'service2': {'service1': True}}
+
+    durations = services.construction_times()
+    assert set(durations) == {'service1', 'service2'}
+
+    duration, path = services.critical_path()
+    assert path == ['service1', 'service2']
+    assert duration == durations['service1'] + durations['service2']
+
+    f = io.StringIO()
+    services.dump_dependency_graph(f, 'json')
+    graph = json.loads(f.getvalue())
+    assert graph['dependencies'] == [{'service': 'service2', 'dependency': 'service1', 'mandatory': True}]
+    assert graph['critical_path']['services'] == ['service1', 'service2']
+
+    f = io.StringIO()
+    services.dump_dependency_graph(f)
+    assert '"service2" -> "service1" [color=red, penwidth=2];' in f.getvalue()
+
+
+def test_load_priority_inversion(caplog):
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test6'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+
+    services = Services()
+    with pytest.raises(exceptions.BadConfiguration, match="'service2' is loaded before its dependency 'service1'"):
+        services.load_services(None, config['services'], {'root': '/tmp/test'}, True)
+    assert len(services) == 0
+
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test8'
+
+    with caplog.at_level(logging.WARNING, 'nagare.services'):
+        services = Services().load_services(None, config['services'], {'root': '/tmp/test'}, True)
+
+    assert "'service2' is loaded before its optional dependency 'service1'" in caplog.text
+    assert list(services) == ['service2', 'service1']
+    assert services['service2'].service1 is None
+
+    # Without validation, the graph is only built on demand
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, 'nagare.services'):
+        services = Services().load_services(None, config['services'], {'root': '/tmp/test'})
+
+    assert not caplog.text
+    assert services._dependency_graph is None
+    assert list(services.dependency_graph.dependencies('service2')) == ['service1']
+
+
+def test_lazy_load():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test2'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+    services = Services().load_services(None, config['services'], {'root': '/tmp/test'}, True, lazy=True)
+
+    assert list(services) == ['service1', 'service2']
+    assert services.pending_services() == ['service1', 'service2']
+
+    service2 = services['service2']
+    assert service2.value2 == '/tmp/test/b.txt'
+    assert service2.service1 is services.get('service1')
+    assert services.pending_services() == []
+
+
+def test_lazy_load_query():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test2'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+    services = Services().load_services(None, config['services'], {'root': '/tmp/test'}, True, lazy=True)
+
+    found = services.query(cls=DummyService3)
+    assert list(found) == ['service1']
+    assert services.pending_services() == ['service2']
+    assert found['service1'] is services['service1']
+
+    assert list(services.query(category='nagare.services.test2')) == ['service1', 'service2']
+    assert services.pending_services() == []
+
+
+def test_reload():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test3'
+
+    config = {
+        'service1': {'value1': '10', 'value2': '/a.txt'},
+        'service2': {'value1': '20', 'value2': '/b.txt'},
+        'service3': {},
+    }
+    services = Services().load_services(None, config, validate=True)
+    service1, service2, service3 = services['service1'], services['service2'], services['service3']
+
+    config['service2']['value1'] = '30'
+    assert services.reload_services(None, config, validate=True) == ['service2']
+    assert services['service1'] is service1
+    assert services['service2'] is not service2
+    assert services['service2'].value1 == 30
+    assert services['service2'].service1 is service1
+    assert services['service3'] is service3
+
+    closed = []
+    service1, service2 = services['service1'], services['service2']
+    service1.close = lambda: closed.append(service1)
+    service2.close = lambda: closed.append(service2)
+
+    config['service1']['value2'] = '/c.txt'
+    assert services.reload_services(None, config, validate=True) == ['service1', 'service2']
+    assert services['service1'].value2 == '/c.txt'
+    assert services['service2'].service1 is services['service1']
+    assert services['service3'] is service3
+
+    # The replaced instances are closed, the dependent services first
+    assert closed == [service2, service1]
+    assert {name: report['status'] for name, report in services.reload_report.items()} == {
+        'service1': 'closed',
+        'service2': 'closed',
+    }
+
+    assert services.reload_services(None, config, validate=True) == []
+
+    config['service1']['activated'] = 'off'
+    service2 = services['service2']
+    with pytest.raises(exceptions.MissingService):
+        services.reload_services(None, config, validate=True)
+
+    assert list(services) == ['service1', 'service2', 'service3']
+    assert services['service2'] is service2
+
+
+def test_lazy_load_unused_service():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test4'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+    services = Services().load_services(None, config['activation2'], {'root': '/tmp/test'}, True, lazy=True)
+
+    assert list(services) == ['service1', 'service3', 'service4']
+
+    assert services(lambda service1_service: service1_service.value1) == 10
+    assert services.pending_services() == ['service3', 'service4']
+
+    with pytest.raises(NotImplementedError):
+        services['service4']
+
+    assert services.pending_services() == ['service3', 'service4']
+
+
+@pytest.mark.parametrize('compile', [False, True])
+def test_lazy_load_injection(compile):
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test2'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+    services = Services().load_services(None, config['services'], {'root': '/tmp/test'}, True, lazy=True)
+
+    @services.inject(compile=compile)
+    def handler(service1_service):
+        return service1_service.value1
+
+    # Decorating a function doesn't instantiate the services it needs
+    assert services.pending_services() == ['service1', 'service2']
+
+    assert handler() == 10
+    assert services.pending_services() == ['service2']
+
+
+def test_deferred_import():
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test7'
+
+    services = Services().load_services(None, {}, lazy=True)
+
+    assert list(services) == ['service2', 'service1']
+    assert 'nagare.services.tests.deferred_services' not in sys.modules
+
+    service1 = services['service1']
+    assert 'nagare.services.tests.deferred_services' in sys.modules
+    assert service1.name == 'service1'
+    assert service1.service2 is services['service2']
+
+
+class ClosableService(object):
+    def __init__(self, closed, delay=0, error=None):
+        self.closed = closed
+        self.delay = delay
+        self.error = error
+        self.barrier = None
+
+    def close(self):
+        if self.barrier is not None:
+            self.barrier.wait()
+
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+
+        self.closed.append(self)
+
+
+class DependentService(ClosableService):
+    def __init__(self, closed, service1_service, delay=0):
+        super(DependentService, self).__init__(closed, delay)
+
+
+class NestedDependentService(ClosableService):
+    def __init__(self, closed, nested_service):
+        super(NestedDependentService, self).__init__(closed)
+
+
+class AsyncClosableService(ClosableService):
+    def __init__(self, closed, service1_service):
+        super(AsyncClosableService, self).__init__(closed)
+
+    async def async_close(self):
+        await asyncio.sleep(0)
+        self.closed.append(self)
+
+
+def create_closable_services(closed):
+    registry = services.Services()
+    registry['service1'] = ClosableService(closed)
+    registry['service2'] = DependentService(closed, None, 0.05)
+    registry['service3'] = DependentService(closed, None, 0.05)
+    registry['service4'] = object()
+    registry['service5'] = ClosableService(closed, error=ValueError())
+
+    return registry
+
+
+def test_shutdown():
+    closed = []
+    registry = create_closable_services(closed)
+
+    # Independent services closed concurrently
+    registry['service2'].barrier = registry['service3'].barrier = threading.Barrier(2, timeout=10)
+
+    report = registry.shutdown()
+
+    assert set(closed[:2]) == {registry['service2'], registry['service3']}
+    assert closed[2] is registry['service1']
+
+    assert set(report) == {'service1', 'service2', 'service3', 'service5'}
+    assert report['service2']['status'] == 'closed'
+    assert report['service2']['duration'] >= 0.05
+    assert report['service5']['status'] == 'failed'
+    assert isinstance(report['service5']['error'], ValueError)
+
+
+def test_shutdown_deadlines():
+    closed = []
+    registry = create_closable_services(closed)
+    registry['service2'].delay = 1
+
+    report = registry.shutdown(timeout=0.1)
+    assert report['service2']['status'] == 'timeout'
+    assert report['service1']['status'] == 'closed'
+    assert registry['service2'] not in closed
+
+    closed = []
+    registry = create_closable_services(closed)
+    registry['service2'].delay = 1
+
+    report = registry.shutdown(global_timeout=0.1)
+    assert report['service2']['status'] == 'timeout'
+    assert report['service3']['status'] == 'closed'
+    assert report['service1']['status'] == 'skipped'
+
+    closed = []
+    registry = create_closable_services(closed)
+    registry['service2'].delay = 1
+
+    # The hooks never started are skipped
+    report = registry.shutdown(global_timeout=0.1, max_workers=1)
+    assert report['service2']['status'] == 'timeout'
+    assert report['service3']['status'] == 'skipped'
+    assert report['service5']['status'] == 'skipped'
+    assert report['service1']['status'] == 'skipped'
+    assert not closed
+
+
+@pytest.mark.parametrize('asynchronous', [False, True])
+def test_nested_shutdown(asynchronous):
+    closed = []
+
+    registry = services.Services()
+    registry['service1'] = ClosableService(closed)
+    registry['nested'] = nested = services.Services()
+    nested['service1'] = ClosableService(closed)
+    nested['service2'] = DependentService(closed, None)
+    registry['service2'] = NestedDependentService(closed, None)
+
+    report = asyncio.run(registry.async_shutdown()) if asynchronous else registry.shutdown()
+    assert registry['service1'] in closed
+    closed.remove(registry['service1'])  # Independent of the nested registry
+    assert closed == [registry['service2'], nested['service2'], nested['service1']]
+    assert set(report) == {'service1', 'service2', 'nested.service1', 'nested.service2'}
+    assert report['nested.service2']['status'] == 'closed'
+
+
+SLOW_SHUTDOWN = """
+import time
+import asyncio
+from nagare.services import services
+
+class Service(object):
+    def close(self):
+        time.sleep(5)
+
+registry = services.Services()
+registry['service'] = Service()
+{}
+"""
+
+
+@pytest.mark.parametrize(
+    'shutdown', ['registry.shutdown(timeout=0.1)', 'asyncio.run(registry.async_shutdown(timeout=0.1))']
+)
+def test_shutdown_exit(shutdown):
+    env = dict(os.environ, PYTHONPATH=str(pathlib.Path(services.__file__).parents[2]))
+
+    # The abandoned hook doesn't delay the closing of the loop nor the exit of the process
+    start = time.perf_counter()
+    # Only runs the current interpreter with a constant code
+    subprocess.run([sys.executable, '-c', SLOW_SHUTDOWN.format(shutdown)], env=env, check=True)  # noqa: S603
+    assert time.perf_counter() - start < 4
+
+
+def test_async_shutdown():
+    closed = []
+    registry = create_closable_services(closed)
+    registry['service4'] = AsyncClosableService(closed, None)
+
+    report = asyncio.run(registry.async_shutdown(timeout=1))
+    assert closed[-1] is registry['service1']
+    assert registry['service4'] in closed
+    assert report['service4']['status'] == 'closed'
+    assert report['service5']['status'] == 'failed'
+
+    closed = []
+    registry = create_closable_services(closed)
+    registry['service2'].delay = 0.5
+
+    report = asyncio.run(registry.async_shutdown(timeout=0.1))
+    assert report['service2']['status'] == 'timeout'
+    assert report['service1']['status'] == 'closed'
+
+
+class ForkableService(object):
+    def __init__(self, calls, name):
+        self.calls = calls
+        self.name = name
+
+    def before_fork(self):
+        self.calls.append(('before_fork', self.name))
+
+    def after_fork_child(self):
+        self.calls.append(('after_fork_child', self.name))
+
+
+class DependentForkableService(ForkableService):
+    def __init__(self, calls, name, service1_service):
+        super(DependentForkableService, self).__init__(calls, name)
+
+
+def test_fork_hooks():
+    calls = []
+    registry = services.Services()
+    registry['service2'] = DependentForkableService(calls, 'service2', None)
+    registry['service1'] = ForkableService(calls, 'service1')
+
+    registry.before_fork()
+    registry.after_fork_child()
+    assert calls == [
+        ('before_fork', 'service2'),
+        ('before_fork', 'service1'),
+        ('after_fork_child', 'service1'),
+        ('after_fork_child', 'service2'),
+    ]
+
+
+def read_memory():
+    """Private and shared memory of the current process, in kB."""
+    with open('/proc/self/smaps_rollup') as f:
+        fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.endswith('kB\n')}
+
+    return fields['Private_Dirty'], fields['Shared_Clean'] + fields['Shared_Dirty']
+
+
+def measure_child(f):
+    """Run a function in a forked process.
+
+    Returns:
+      the string written by the function
+    """
+    r, w = os.pipe()
+
+    pid = os.fork()
+    if not pid:
+        try:
+            os.write(w, f().encode('ascii'))
+        finally:
+            os._exit(0)
+
+    os.close(w)
+    with os.fdopen(r) as f:
+        result = f.read()
+    os.waitpid(pid, 0)
+
+    return result
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/smaps_rollup'), reason='no /proc/self/smaps_rollup')
+def test_prefork_memory():
+    def collect():
+        private_before, shared_before = read_memory()
+        gc.collect()
+        private_after, shared_after = read_memory()
+
+        return '{} {} {} {}'.format(private_before, shared_before, private_after, shared_after)
+
+    def create_services():
+        registry = services.Services()
+        registry.update({'service{}'.format(i): {'value': [i]} for i in range(50000)})
+
+        return registry
+
+    registry = create_services()
+    gc.collect()
+    private_before, shared_before, private_after, shared_after = map(int, measure_child(collect).split())
+    assert shared_before > private_before
+    dirtied = private_after - private_before
+
+    del registry
+    gc.collect()
+
+    registry = create_services()
+    registry.prefork(register_at_fork=False)
+    try:
+        private_before, shared_before, private_after, shared_after = map(int, measure_child(collect).split())
+    finally:
+        gc.unfreeze()
+
+    # The collection in the child doesn't write into the frozen objects shared with the parent
+    assert (private_after - private_before) < dirtied / 4
+    assert shared_after > private_after
+
+
+def test_prefork_hooks():
+    calls = []
+
+    class Services(DummyServices):
+        ENTRY_POINTS = 'nagare.services.test2'
+
+    config = config_from_file(os.path.join(os.path.dirname(__file__), 'services.cfg'))
+    registry = Services().load_services(None, config['services'], {'root': '/tmp/test'}, True, lazy=True)
+    registry['forkable'] = ForkableService(calls, 'forkable')
+
+    # Not registering the hooks in the process running the tests
+    registry.prefork(register_at_fork=False)
+    try:
+        assert registry.pending_services() == []
+        assert not registry.fork_hooks_registered
+
+        def child():
+            registry.after_fork_child()
+            return repr(calls)
+
+        registry.before_fork()
+        assert measure_child(child) == repr([('before_fork', 'forkable'), ('after_fork_child', 'forkable')])
+        assert calls == [('before_fork', 'forkable')]
+    finally:
+        gc.unfreeze()
+
+
+# The heavy modules are only imported when the plugins are discovered, validated or reported
+HEAVY_MODULES = {
+    'json',
+    'configobj',
+    'nagare.config',
+    'nagare.packaging',
+    'importlib.metadata',
+    'nagare.services.discovery',
+    'nagare.services.reporters',
+}
+IMPORT_BUDGET = 1  # Import time of the registry module, relative to the import time of its package
+
+
+def imported_modules(module):
+    """Import a module in a fresh interpreter.
+
+    Return:
+      names of all the modules imported
+    """
+    env = dict(os.environ, PYTHONPATH=str(pathlib.Path(services.__file__).parents[2]))
+    # Only runs the current interpreter with a constant code
+    stdout = subprocess.run(  # noqa: S603
+        [sys.executable, '-c', 'import sys, {}; print("\\n".join(sys.modules))'.format(module)],
+        env=env,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout
+
+    return set(stdout.splitlines())
+
+
+@pytest.mark.parametrize('module', ['nagare.services.services', 'nagare.services.plugins'])
+def test_imported_modules(module):
+    modules = imported_modules(module)
+
+    assert module in modules
+    assert not (HEAVY_MODULES & modules)
+
+
+def import_times(modules, pycache_prefix):
+    """Import modules, one after the other, in a fresh interpreter.
+
+    Args:
+      modules: names of the modules
+      pycache_prefix: directory of the compiled modules cache
+
+    Return:
+      dictionary of the imported modules -> cumulative import times, in microseconds
+    """
+    env = dict(os.environ, PYTHONPATH=str(pathlib.Path(services.__file__).parents[2]))
+    env['PYTHONPYCACHEPREFIX'] = pycache_prefix
+    env.pop('PYTHONDONTWRITEBYTECODE', None)  # Not measuring the compilation of the modules
+
+    # Only runs the current interpreter with a constant code
+    stderr = subprocess.run(  # noqa: S603
+        [sys.executable, '-X', 'importtime', '-c', '; '.join('import ' + module for module in modules)],
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr
+
+    times = {}
+    for line in stderr.splitlines()[1:]:  # Skipping the header
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def test_import_time(tmp_path):
+    modules = ('nagare.services', 'nagare.services.services')
+    import_times(modules, str(tmp_path))  # Filling the compiled modules cache
+
+    # The import of the package, in the same interpreter, calibrates the budget to the machine speed
+    times = [import_times(modules, str(tmp_path)) for _ in range(10)]
+    package_time = statistics.median(t['nagare.services'] for t in times)
+    registry_time = statistics.median(t['nagare.services.services'] for t in times)
+
+    assert registry_time < IMPORT_BUDGET * package_time